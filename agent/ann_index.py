@@ -0,0 +1,70 @@
+import math
+import numpy as np
+
+# Cap the number of rows used to train centroids so large corpora still build quickly
+MAX_TRAINING_ROWS_PER_LIST = 256
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest neighbour index over unit-normalized vectors.
+
+    Rows are clustered around `nlist` centroids with spherical k-means. A query is
+    only scored against the rows of its `nprobe` closest clusters, which trades
+    recall for latency: nprobe == nlist is exact search, smaller values are faster.
+    New rows are assigned to their nearest existing centroid, so inserts are cheap
+    and the centroids are only retrained on an explicit build().
+    """
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, train_iterations: int = 10, seed: int = 0):
+        # nlist == 0 picks sqrt(rows) at build time
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.train_iterations = train_iterations
+        self.seed = seed
+        self.centroids = None
+        self.lists: list[np.ndarray] = []
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def build(self, matrix: np.ndarray):
+        """Train centroids on `matrix` and assign every row to its inverted list."""
+        n = matrix.shape[0]
+        nlist = self.nlist or max(1, int(math.sqrt(n)))
+        nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(self.seed)
+        sample = matrix
+        if n > nlist * MAX_TRAINING_ROWS_PER_LIST:
+            sample = matrix[rng.choice(n, nlist * MAX_TRAINING_ROWS_PER_LIST, replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.train_iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Re-seed empty clusters from random rows instead of letting them die
+                sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+        self.centroids = centroids
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.add(matrix, 0)
+
+    def add(self, rows: np.ndarray, start: int):
+        """Assign rows numbered start..start+len(rows) to their nearest centroid."""
+        if not self.trained:
+            raise ValueError("IVFIndex must be built before rows can be added")
+        assignments = np.argmax(rows @ self.centroids.T, axis=1)
+        ids = np.arange(start, start + rows.shape[0], dtype=np.int64)
+        for list_id in np.unique(assignments):
+            self.lists[list_id] = np.concatenate([self.lists[list_id], ids[assignments == list_id]])
+
+    def candidates(self, query_vectors: np.ndarray, nprobe: int | None = None) -> list[np.ndarray]:
+        """Return, for each query row, the row ids in its nprobe closest inverted lists."""
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        probe = np.argsort(-(query_vectors @ self.centroids.T), axis=1)[:, :nprobe]
+        return [np.concatenate([self.lists[i] for i in row]) for row in probe]
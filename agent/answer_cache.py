@@ -0,0 +1,78 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+import numpy as np
+from prometheus_client import Counter, Gauge
+from query_embeddings import normalize_query
+
+ANSWER_CACHE_HITS = Counter('answer_cache_hits_total', 'Chat answers served from the semantic cache')
+ANSWER_CACHE_MISSES = Counter('answer_cache_misses_total', 'Chat answers that ran the workflow')
+ANSWER_CACHE_SIZE = Gauge('answer_cache_entries', 'Answers currently in the semantic cache')
+
+
+def context_fingerprint(*parts) -> str:
+    """Hash everything besides the question that the answer depends on."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SemanticAnswerCache:
+    """Cache of final answers looked up by question-embedding similarity.
+
+    An entry matches when it was stored under the same context fingerprint and its
+    question embedding has cosine similarity >= `threshold` with the new question.
+    Entries expire after `ttl` seconds and the least recently used entry is evicted
+    once `maxsize` is reached.
+    """
+
+    def __init__(self, threshold: float = 0.95, maxsize: int = 512, ttl: float = 3600):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # (fingerprint, normalized question) -> (unit vector, answer, expires_at)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, question: str, vector, fingerprint: str) -> str | None:
+        now = time.monotonic()
+        expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        keys = [key for key in self._entries if key[0] == fingerprint]
+        answer = None
+        if keys:
+            exact = (fingerprint, normalize_query(question))
+            if exact in self._entries:
+                best = exact
+            else:
+                query = np.asarray(vector, dtype=np.float32)
+                query /= max(float(np.linalg.norm(query)), 1e-12)
+                similarities = np.stack([self._entries[key][0] for key in keys]) @ query
+                position = int(np.argmax(similarities))
+                best = keys[position] if similarities[position] >= self.threshold else None
+            if best is not None:
+                self._entries.move_to_end(best)
+                answer = self._entries[best][1]
+        if answer is None:
+            ANSWER_CACHE_MISSES.inc()
+        else:
+            ANSWER_CACHE_HITS.inc()
+        ANSWER_CACHE_SIZE.set(len(self._entries))
+        return answer
+
+    def store(self, question: str, vector, fingerprint: str, answer: str):
+        unit = np.asarray(vector, dtype=np.float32)
+        unit = unit / max(float(np.linalg.norm(unit)), 1e-12)
+        key = (fingerprint, normalize_query(question))
+        self._entries[key] = (unit, answer, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        ANSWER_CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        ANSWER_CACHE_SIZE.set(0)
@@ -0,0 +1,105 @@
+"""Benchmark recall@k and latency of the IVF index against exact search.
+
+Uses the embeddings from an index snapshot when --snapshot is given, otherwise a
+synthetic clustered corpus. Queries are perturbed copies of random corpus rows.
+
+    python benchmarks/ann_recall.py --size 50000 --nprobe 1 4 8 16 32
+    python benchmarks/ann_recall.py --snapshot index --json results/ann.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ann_index import IVFIndex  # noqa: E402
+from vector_store import normalize, top_k  # noqa: E402
+
+
+def synthetic_corpus(size, dim, clusters, rng):
+    centers = rng.normal(size=(clusters, dim))
+    labels = rng.integers(0, clusters, size)
+    return normalize(centers[labels] + rng.normal(size=(size, dim)))
+
+
+def snapshot_corpus(path):
+    manifest_path = os.path.join(path, "manifest.json")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    print(f"Using snapshot {path} ({manifest['count']} chunks)")
+    return normalize(np.load(os.path.join(path, "embeddings.npy")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshot", help="index snapshot directory to benchmark instead of synthetic data")
+    parser.add_argument("--size", type=int, default=20000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="synthetic embedding dimensions")
+    parser.add_argument("--clusters", type=int, default=200, help="synthetic topic clusters")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nlist", type=int, default=0, help="0 picks sqrt(corpus size)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this JSON file")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.snapshot:
+        matrix = snapshot_corpus(args.snapshot)
+    else:
+        matrix = synthetic_corpus(args.size, args.dim, args.clusters, rng)
+    queries = normalize(
+        matrix[rng.integers(0, matrix.shape[0], args.queries)]
+        + 0.5 * rng.normal(size=(args.queries, matrix.shape[1]))
+    )
+
+    # Both paths search one query at a time, the way the retriever tool does
+    start = time.perf_counter()
+    exact = [top_k(matrix @ query, args.k) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+
+    index = IVFIndex(nlist=args.nlist, seed=args.seed)
+    start = time.perf_counter()
+    index.build(matrix)
+    build_s = time.perf_counter() - start
+    print(f"corpus={matrix.shape[0]}x{matrix.shape[1]} nlist={len(index.lists)} build={build_s:.2f}s")
+    print(f"exact: {exact_ms:.3f} ms/query")
+
+    results = []
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        found = []
+        for query, candidates in zip(queries, index.candidates(queries, nprobe)):
+            scores = matrix[candidates] @ query
+            found.append(candidates[top_k(scores, args.k)])
+        ivf_ms = (time.perf_counter() - start) * 1000 / args.queries
+        recall = np.mean([
+            len(set(f.tolist()) & set(e.tolist())) / len(e) for f, e in zip(found, exact)
+        ])
+        results.append({"nprobe": nprobe, f"recall@{args.k}": float(recall), "ms_per_query": ivf_ms})
+        print(f"nprobe={nprobe:<4} recall@{args.k}={recall:.3f} {ivf_ms:.3f} ms/query ({exact_ms / ivf_ms:.1f}x vs exact)")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "corpus_size": int(matrix.shape[0]),
+                    "dimensions": int(matrix.shape[1]),
+                    "nlist": len(index.lists),
+                    "k": args.k,
+                    "build_seconds": build_s,
+                    "exact_ms_per_query": exact_ms,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Load-test the chat API with concurrent multi-turn conversations.
+
+Unless --url points at a running server, starts the agent in a uvicorn subprocess
+with the offline fake models (MODEL_BACKEND=fake; tune them with the FAKE_*
+variables). Virtual users hold conversations over /chat (as Server-Sent Events)
+or /chat/ws. Reports throughput, latency and time-to-first-token percentiles, and
+the server's event-loop lag and RSS growth scraped from /metrics.
+
+    python benchmarks/chat_load.py --users 20 --duration 60
+    python benchmarks/chat_load.py --url http://localhost:8000 --ws-ratio 1 --json results/load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+import httpx
+import numpy as np
+import websockets
+from prometheus_client.parser import text_string_to_metric_families
+
+AGENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Each virtual user picks one of these per conversation and asks its questions in order
+CONVERSATIONS = [
+    ["Which status code should a validation error return?", "What should the error body contain?",
+     "Should it list every invalid field?"],
+    ["How should I name resource URLs?", "Plural or singular nouns?", "What about nested resources?",
+     "How deep should nesting go?"],
+    ["How do I version a REST API?", "Should the version be in the URL or a header?"],
+    ["What is the guidance on pagination?", "Cursor or offset based?", "How do I return the total count?"],
+    ["When should I use PUT instead of PATCH?", "Does PUT have to be idempotent?"],
+    ["How should dates and times be formatted?", "Which time zone should responses use?",
+     "What about date-only values?"],
+    ["What does the guideline say about rate limiting?"],
+    ["How should I represent enums in JSON?", "Strings or integers?", "Upper or lower case?"],
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port, log):
+    env = {**os.environ, "MODEL_BACKEND": os.environ.get("MODEL_BACKEND", "fake")}
+    env.setdefault("OPENAI_API_KEY", "unused")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=AGENT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(client, base_url, timeout, server=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}")
+        try:
+            if (await client.get(f"{base_url}/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"{base_url} was not ready after {timeout}s")
+
+
+async def scrape(client, base_url):
+    """RSS and the event-loop lag histogram from the server's /metrics."""
+    text = (await client.get(f"{base_url}/metrics")).text
+    stats = {"rss_bytes": None, "lag_buckets": {}, "lag_sum": 0.0, "lag_count": 0.0}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == "process_resident_memory_bytes":
+                stats["rss_bytes"] = sample.value
+            elif sample.name == "event_loop_lag_seconds_bucket":
+                stats["lag_buckets"][float(sample.labels["le"])] = sample.value
+            elif sample.name == "event_loop_lag_seconds_sum":
+                stats["lag_sum"] = sample.value
+            elif sample.name == "event_loop_lag_seconds_count":
+                stats["lag_count"] = sample.value
+    return stats
+
+
+def lag_summary(before, after):
+    """Mean and bucket-resolution quantiles of the lag observed between two scrapes."""
+    count = after["lag_count"] - before["lag_count"]
+    if count <= 0:
+        return None
+    cumulative = sorted((le, after["lag_buckets"][le] - before["lag_buckets"].get(le, 0.0)) for le in after["lag_buckets"])
+
+    def quantile(q):
+        for le, seen in cumulative:
+            if seen >= q * count:
+                return le
+        return float("inf")
+
+    return {
+        "samples": int(count),
+        "mean_ms": (after["lag_sum"] - before["lag_sum"]) / count * 1000,
+        # Upper bounds of the histogram buckets the quantiles fall in
+        "p50_ms_le": quantile(0.5) * 1000,
+        "p99_ms_le": quantile(0.99) * 1000,
+    }
+
+
+def turn_result(transport, started, first_token, final):
+    return {
+        "transport": transport,
+        "latency": time.perf_counter() - started,
+        "ttft": None if first_token is None else first_token - started,
+        "cached": bool(final.get("cached")),
+        "timed_out": bool(final.get("timed_out")),
+    }
+
+
+async def sse_turn(client, base_url, user_id, question):
+    started = time.perf_counter()
+    first_token = None
+    final = None
+    async with client.stream(
+        "POST", f"{base_url}/chat", json={"user_id": user_id, "message": question},
+        headers={"Accept": "text/event-stream"},
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event["type"] == "token" and first_token is None:
+                first_token = time.perf_counter()
+            elif event["type"] == "final":
+                final = event
+    if final is None:
+        raise RuntimeError("stream ended without a final event")
+    return turn_result("sse", started, first_token, final)
+
+
+async def ws_turn(ws, question, timeout):
+    started = time.perf_counter()
+    first_token = None
+    await ws.send(question)
+    while True:
+        # Like the SSE client's read timeout, so a stuck turn cannot stall its user for the rest of the run
+        event = json.loads(await asyncio.wait_for(ws.recv(), timeout))
+        if event["type"] == "token" and first_token is None:
+            first_token = time.perf_counter()
+        elif event["type"] == "final":
+            return turn_result("ws", started, first_token, event)
+
+
+async def conversation(client, base_url, questions, transport, think_time, request_timeout, rng, results, errors):
+    user_id = f"load-{uuid.uuid4().hex[:12]}"
+    ws = None
+    try:
+        if transport == "ws":
+            ws_url = base_url.replace("http", "ws", 1)
+            ws = await websockets.connect(f"{ws_url}/chat/ws?user_id={user_id}", max_size=None)
+        for question in questions:
+            if ws is not None:
+                results.append(await ws_turn(ws, question, request_timeout))
+            else:
+                results.append(await sse_turn(client, base_url, user_id, question))
+            if think_time > 0:
+                await asyncio.sleep(rng.expovariate(1 / think_time))
+    except Exception as e:
+        # A failed turn ends its conversation; the user starts a new one
+        errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+    finally:
+        if ws is not None:
+            await ws.close()
+
+
+async def virtual_user(client, base_url, args, stop_at, rng, results, errors):
+    while time.monotonic() < stop_at:
+        questions = rng.choice(CONVERSATIONS)
+        if args.unique:
+            # Different wording per conversation, so the answer cache cannot serve it
+            nonce = uuid.uuid4().hex[:6]
+            questions = [f"{q} ({nonce})" for q in questions]
+        transport = "ws" if rng.random() < args.ws_ratio else "sse"
+        await conversation(
+            client, base_url, questions, transport, args.think_time, args.request_timeout, rng, results, errors
+        )
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def summarize(results):
+    return {
+        "turns": len(results),
+        "cached": sum(r["cached"] for r in results),
+        "timed_out": sum(r["timed_out"] for r in results),
+        "latency": percentiles([r["latency"] for r in results]),
+        "ttft": percentiles([r["ttft"] for r in results if r["ttft"] is not None]),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=AGENT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(name, summary):
+    line = f"{name:<5} turns={summary['turns']:<6} cached={summary['cached']:<5} timed_out={summary['timed_out']:<4}"
+    for key in ("latency", "ttft"):
+        if summary[key]:
+            s = summary[key]
+            line += f" {key} p50={s['p50_ms']:.0f} p95={s['p95_ms']:.0f} p99={s['p99_ms']:.0f} ms"
+    print(line)
+
+
+async def run(args):
+    server = None
+    log = None
+    base_url = args.url.rstrip("/") if args.url else None
+    limits = httpx.Limits(max_connections=args.users + 10, max_keepalive_connections=args.users + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(args.request_timeout)) as client:
+        try:
+            if base_url is None:
+                port = free_port()
+                base_url = f"http://127.0.0.1:{port}"
+                log = open(args.server_log, "w", encoding="utf-8") if args.server_log else subprocess.DEVNULL
+                server = start_server(port, log)
+                print(f"Started agent on {base_url} (MODEL_BACKEND={os.environ.get('MODEL_BACKEND', 'fake')})")
+            await wait_ready(client, base_url, args.startup_timeout, server)
+            before = await scrape(client, base_url)
+
+            rng = random.Random(args.seed)
+            results, errors = [], {}
+            started = time.perf_counter()
+            stop_at = time.monotonic() + args.duration
+            await asyncio.gather(*(
+                virtual_user(client, base_url, args, stop_at, random.Random(rng.random()), results, errors)
+                for _ in range(args.users)
+            ))
+            elapsed = time.perf_counter() - started
+            after = await scrape(client, base_url)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+            if log not in (None, subprocess.DEVNULL):
+                log.close()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {
+            "url": args.url, "users": args.users, "duration": args.duration, "think_time": args.think_time,
+            "ws_ratio": args.ws_ratio, "unique": args.unique, "seed": args.seed,
+            "model_backend": None if args.url else os.environ.get("MODEL_BACKEND", "fake"),
+            "fake": None if args.url else {k: v for k, v in os.environ.items() if k.startswith("FAKE_")},
+        },
+        "elapsed_seconds": elapsed,
+        "throughput_turns_per_second": len(results) / elapsed,
+        "errors": errors,
+        "overall": summarize(results),
+        "by_transport": {t: summarize([r for r in results if r["transport"] == t]) for t in ("sse", "ws")},
+        "server": {
+            "rss_start_bytes": before["rss_bytes"],
+            "rss_end_bytes": after["rss_bytes"],
+            "rss_growth_bytes": None if before["rss_bytes"] is None or after["rss_bytes"] is None
+            else after["rss_bytes"] - before["rss_bytes"],
+            "event_loop_lag": lag_summary(before, after),
+        },
+    }
+
+    print(f"{len(results)} turns in {elapsed:.1f}s: {report['throughput_turns_per_second']:.2f} turns/s, errors={errors}")
+    print_summary("all", report["overall"])
+    for transport, summary in report["by_transport"].items():
+        if summary["turns"]:
+            print_summary(transport, summary)
+    if report["server"]["rss_growth_bytes"] is not None:
+        print(f"server RSS {before['rss_bytes'] / 2**20:.0f} -> {after['rss_bytes'] / 2**20:.0f} MiB")
+    lag = report["server"]["event_loop_lag"]
+    if lag:
+        print(f"event-loop lag mean={lag['mean_ms']:.1f} ms p50<={lag['p50_ms_le']:.1f} ms p99<={lag['p99_ms_le']:.1f} ms")
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="base URL of a running agent; by default one is started with fake models")
+    parser.add_argument("--users", type=int, default=10, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to start new conversations for")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between a user's turns")
+    parser.add_argument("--ws-ratio", type=float, default=0.5, help="share of conversations held over /chat/ws")
+    parser.add_argument("--unique", action="store_true", help="make every question unique to bypass the answer cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--request-timeout", type=float, default=120, help="seconds to wait for each response read or websocket frame"
+    )
+    parser.add_argument("--startup-timeout", type=float, default=300, help="seconds to wait for /ready")
+    parser.add_argument("--server-log", help="write the started server's output to this file")
+    parser.add_argument("--json", help="write results to this JSON file")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import math
+import re
+from collections import Counter, defaultdict
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase alphanumeric tokens; "Retry-After" becomes ["retry", "after"]."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """In-process inverted index with Okapi BM25 scoring.
+
+    Each term maps to parallel arrays of document positions and term frequencies,
+    so scoring a query only touches the postings of the terms it contains.
+    """
+
+    def __init__(self, texts: list[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+        self.lengths = np.zeros(self.size, dtype=np.float32)
+        postings = defaultdict(list)
+        for position, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.lengths[position] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings[term].append((position, tf))
+        self.average_length = float(self.lengths.mean()) if self.size else 0.0
+        self.postings = {}
+        self.idf = {}
+        for term, entries in postings.items():
+            positions, tfs = zip(*entries)
+            self.postings[term] = (np.array(positions, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            df = len(entries)
+            self.idf[term] = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query; zero where no query term occurs."""
+        scores = np.zeros(self.size, dtype=np.float32)
+        if not self.size:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / max(self.average_length, 1e-9))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            positions, tfs = self.postings[term]
+            scores[positions] += self.idf[term] * tfs * (self.k1 + 1) / (tfs + norm[positions])
+        return scores
+
+    def search(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Return up to k (document position, score) pairs with a non-zero score, best first."""
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores)
+        if matched.size > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in matched]
@@ -0,0 +1,59 @@
+import asyncio
+import math
+import os
+import time
+
+# Wall-clock budget for one chat turn, across every LLM and tool call in the graph run
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "30"))
+# How many times a turn may go round the rewrite_question -> generate_query_or_respond loop
+MAX_REWRITES = int(os.getenv("MAX_REWRITES", "2"))
+# With less time than this left, stop retrieving/rewriting and answer with what we have
+MIN_STEP_SECONDS = float(os.getenv("MIN_STEP_SECONDS", "5"))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def new_deadline(timeout: float = REQUEST_TIMEOUT) -> float:
+    return time.monotonic() + timeout
+
+
+def remaining(state) -> float:
+    """Seconds left before the run's deadline; infinite when the run has none."""
+    deadline = state.get("deadline")
+    return math.inf if deadline is None else deadline - time.monotonic()
+
+
+def out_of_time(state) -> bool:
+    """True when there is only time left for answering."""
+    return remaining(state) < MIN_STEP_SECONDS
+
+
+def nearly_spent(state) -> bool:
+    """True when the run should stop looping and go straight to an answer."""
+    return state.get("rewrites", 0) >= MAX_REWRITES or out_of_time(state)
+
+
+async def within(awaitable, state):
+    """Await `awaitable`, cancelling it (and any HTTP request it is making) at the run's deadline."""
+    left = remaining(state)
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, None if math.isinf(left) else left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded() from None
+
+
+async def invoke_within(runnable, input, state):
+    """Invoke `runnable` within the run's deadline."""
+    return await within(runnable.ainvoke(input), state)
+
+
+def recursion_limit(max_rewrites: int = MAX_REWRITES) -> int:
+    # Each rewrite loop visits 4 nodes (generate_query_or_respond, retrieve, grade_documents,
+    # rewrite_question), plus the final pass through the first three and generate_answer
+    return 4 * max_rewrites + 5
@@ -0,0 +1,82 @@
+import os
+from functools import lru_cache
+import tiktoken
+from ttl_cache import TTLCache
+
+# Formatted history lines and their token counts, keyed by message id, so the
+# grader, rewriter and generator of one run only tokenize each message once
+_line_cache = TTLCache(maxsize=10000, ttl=600)
+
+
+class WordEncoder:
+    """Stand-in for a tiktoken encoding that treats each word as a token."""
+
+    def encode(self, text: str, **kwargs) -> list[str]:
+        return text.split()
+
+
+def token_encoding() -> str:
+    """The encoding tokens are counted with, read when first needed so a .env file can set it.
+
+    gpt2 is the one RecursiveCharacterTextSplitter.from_tiktoken_encoder uses by default;
+    tiktoken downloads it on first use unless TIKTOKEN_CACHE_DIR holds a copy. "words"
+    counts whitespace-separated words and needs no download; it is the default with
+    MODEL_BACKEND=fake so the offline models really run offline.
+    """
+    return os.getenv("TOKEN_ENCODING", "words" if os.getenv("MODEL_BACKEND") == "fake" else "gpt2")
+
+
+@lru_cache(maxsize=1)
+def get_encoder():
+    # Loaded on first use; tiktoken may have to download the encoding
+    if token_encoding() == "words":
+        return WordEncoder()
+    return tiktoken.get_encoding(token_encoding())
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoder().encode(text, disallowed_special=()))
+
+
+def get_message_role_content(m):
+    if isinstance(m, dict):
+        role = m.get("role", "user")
+        content = m.get("content", str(m))
+    else:
+        role = getattr(m, "type", "user")
+        content = getattr(m, "content", str(m))
+    return f"{role}: {content}"
+
+
+def _formatted_line(m):
+    message_id = None if isinstance(m, dict) else getattr(m, "id", None)
+    if message_id is not None:
+        cached = _line_cache.get(message_id)
+        if cached is not None:
+            return cached
+    line = get_message_role_content(m)
+    # +1 for the newline joining the lines
+    entry = (line, count_tokens(line) + 1)
+    if message_id is not None:
+        _line_cache.set(message_id, entry)
+    return entry
+
+
+def format_history(messages, max_tokens: int, summary: str = "") -> str:
+    """Format the newest messages that fit in `max_tokens`, oldest first.
+
+    Older messages are dropped whole; a single message larger than the budget is
+    dropped too, so the prompt never exceeds it. max_tokens <= 0 keeps everything.
+    A running summary of compacted turns, if any, is put in front.
+    """
+    lines = []
+    used = 0
+    for m in reversed(messages):
+        line, tokens = _formatted_line(m)
+        if max_tokens > 0 and used + tokens > max_tokens:
+            break
+        lines.append(line)
+        used += tokens
+    if summary:
+        lines.append(f"Summary of earlier conversation: {summary}")
+    return "\n".join(reversed(lines))
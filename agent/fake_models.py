@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.5"))
+FAKE_LLM_TOKEN_LATENCY = float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0.01"))
+FAKE_LLM_JITTER = float(os.getenv("FAKE_LLM_JITTER", "0.1"))
+FAKE_LLM_ANSWER_TOKENS = int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "40"))
+FAKE_EMBEDDING_LATENCY = float(os.getenv("FAKE_EMBEDDING_LATENCY", "0.05"))
+FAKE_EMBEDDING_JITTER = float(os.getenv("FAKE_EMBEDDING_JITTER", "0.01"))
+FAKE_EMBEDDING_SIZE = int(os.getenv("FAKE_EMBEDDING_SIZE", "256"))
+
+# Offline stand-ins for the chat and embedding models, selected with MODEL_BACKEND=fake.
+# Outputs depend only on the input, so benchmark runs are reproducible; latency is simulated.
+
+# Returned for string fields described as ISO 8601 dates
+FAKE_TIMESTAMP = "2024-01-01T00:00:00Z"
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _delay(text: str, base: float, jitter: float) -> float:
+    """Simulated latency; the jitter is drawn from the input, so it is the same on every run."""
+    if base <= 0 and jitter <= 0:
+        return 0.0
+    return max(0.0, base + random.Random(_seed(text)).uniform(-jitter, jitter))
+
+
+class FakeEmbeddings(Embeddings):
+    """Feature-hashing embeddings: each word adds +-1 at a hashed position, then the vector is normalized.
+
+    Texts sharing words get a positive cosine similarity, so retrieval, pre-grading
+    and the answer cache behave roughly like they do with a real model.
+    """
+
+    def __init__(
+        self,
+        size: int = FAKE_EMBEDDING_SIZE,
+        latency: float = FAKE_EMBEDDING_LATENCY,
+        jitter: float = FAKE_EMBEDDING_JITTER,
+    ):
+        self.size = size
+        self.latency = latency
+        self.jitter = jitter
+        # Read as the cache namespace and snapshot key, like OpenAIEmbeddings.model
+        self.model = f"fake-hash-{size}"
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            position = int.from_bytes(digest[:4], "big") % self.size
+            vector[position] += 1.0 if digest[4] & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(_delay("".join(texts), self.latency, self.jitter))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(_delay(text, self.latency, self.jitter))
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(_delay("".join(texts), self.latency, self.jitter))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(_delay(text, self.latency, self.jitter))
+        return self._embed(text)
+
+
+def sample_from_schema(schema: dict, fallback: str, defs: Optional[dict] = None) -> Any:
+    """Build a value that satisfies a JSON schema, the same one for the same schema and fallback.
+
+    Strings are the first quoted example in the field description (so a grader
+    described as "'yes' if relevant" answers yes), a fixed timestamp for ISO 8601
+    dates, and `fallback` otherwise. Arrays get a single item.
+    """
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], fallback, defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            # Optional fields keep their description on the outer schema
+            return sample_from_schema({"description": schema.get("description", ""), **options[0]}, fallback, defs)
+    if "default" in schema and schema["default"] is not None:
+        return schema["default"]
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {name: sample_from_schema(prop, fallback, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), fallback, defs)]
+    if kind == "integer":
+        return 0
+    if kind == "number":
+        return 0.0
+    if kind == "boolean":
+        return True
+    description = schema.get("description", "")
+    if "ISO 8601" in description or schema.get("format") in ("date", "date-time"):
+        return FAKE_TIMESTAMP
+    quoted = re.search(r"'([^']+)'", description)
+    return quoted.group(1) if quoted else fallback
+
+
+def _text(message: BaseMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content)
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model that supports tools, structured output and streaming.
+
+    With tools bound it calls one when the conversation ends with a user message
+    (or when tool_choice forces it), filling the arguments from the tool's schema
+    with the last user message as the text; otherwise it answers with words drawn
+    from the prompt. Usage metadata counts words as tokens.
+    """
+
+    model_name: str = "fake"
+    latency: float = FAKE_LLM_LATENCY
+    token_latency: float = FAKE_LLM_TOKEN_LATENCY
+    jitter: float = FAKE_LLM_JITTER
+    answer_tokens: int = FAKE_LLM_ANSWER_TOKENS
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], tool_choice=tool_choice, **kwargs)
+
+    def _respond(self, messages: list[BaseMessage], tools=None, tool_choice=None) -> AIMessage:
+        prompt = "\n".join(_text(m) for m in messages)
+        last_user = next((_text(m) for m in reversed(messages) if isinstance(m, HumanMessage)), prompt)
+        prompt_tokens = len(prompt.split())
+        forced = tool_choice not in (None, "auto", "none")
+        if tools and (forced or isinstance(messages[-1], HumanMessage)):
+            tool = tools[0]["function"]
+            if isinstance(tool_choice, str) and tool_choice not in ("any", "required", "auto", "none"):
+                tool = next((t["function"] for t in tools if t["function"]["name"] == tool_choice), tool)
+            elif isinstance(tool_choice, dict):
+                name = tool_choice.get("function", {}).get("name")
+                tool = next((t["function"] for t in tools if t["function"]["name"] == name), tool)
+            args = sample_from_schema(tool.get("parameters", {}), last_user)
+            call_id = hashlib.sha256((prompt + tool["name"]).encode("utf-8")).hexdigest()[:24]
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": tool["name"], "args": args, "id": f"call_{call_id}"}],
+                usage_metadata={"input_tokens": prompt_tokens, "output_tokens": len(json.dumps(args).split()),
+                                "total_tokens": prompt_tokens + len(json.dumps(args).split())},
+            )
+        words = re.findall(r"\w+", prompt) or ["ok"]
+        rng = random.Random(_seed(prompt))
+        answer = " ".join(rng.choice(words) for _ in range(self.answer_tokens))
+        return AIMessage(
+            content=answer,
+            usage_metadata={"input_tokens": prompt_tokens, "output_tokens": self.answer_tokens,
+                            "total_tokens": prompt_tokens + self.answer_tokens},
+        )
+
+    def _timings(self, messages, response: AIMessage):
+        first = _delay("\n".join(_text(m) for m in messages), self.latency, self.jitter)
+        tokens = response.content.split(" ") if response.content else []
+        return first, tokens
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs) -> ChatResult:
+        response = self._respond(messages, tools, tool_choice)
+        first, tokens = self._timings(messages, response)
+        time.sleep(first + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs) -> ChatResult:
+        response = self._respond(messages, tools, tool_choice)
+        first, tokens = self._timings(messages, response)
+        await asyncio.sleep(first + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=response)])
+
+    def _chunks(self, response: AIMessage, tokens: list[str]):
+        if response.tool_calls:
+            yield AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                    for i, c in enumerate(response.tool_calls)
+                ],
+                usage_metadata=response.usage_metadata,
+            )
+            return
+        for i, token in enumerate(tokens):
+            last = i == len(tokens) - 1
+            yield AIMessageChunk(
+                content=token if last else token + " ",
+                # Reported once, on the last chunk, like OpenAI's stream usage
+                usage_metadata=response.usage_metadata if last else None,
+            )
+
+    def _stream(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs):
+        response = self._respond(messages, tools, tool_choice)
+        first, tokens = self._timings(messages, response)
+        time.sleep(first)
+        for chunk in self._chunks(response, tokens):
+            if chunk.content:
+                time.sleep(self.token_latency)
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=generation)
+            yield generation
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, tool_choice=None, **kwargs):
+        response = self._respond(messages, tools, tool_choice)
+        first, tokens = self._timings(messages, response)
+        await asyncio.sleep(first)
+        for chunk in self._chunks(response, tokens):
+            if chunk.content:
+                await asyncio.sleep(self.token_latency)
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=generation)
+            yield generation
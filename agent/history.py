@@ -0,0 +1,402 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Protocol
+from langchain_core.messages import BaseMessage, convert_to_messages
+from prometheus_client import Counter, Gauge
+
+HISTORY_USERS = Gauge('chat_history_users', 'Users with stored chat history')
+HISTORY_MESSAGES = Gauge('chat_history_messages', 'Stored chat history messages')
+HISTORY_CHARS = Gauge('chat_history_chars', 'Characters of stored chat history content')
+HISTORY_EVICTIONS = Counter('chat_history_evictions_total', 'Users evicted from chat history', ['reason'])
+
+
+def message_to_dict(message: BaseMessage) -> dict:
+    role = {"human": "user", "ai": "assistant"}.get(message.type, message.type)
+    return {"role": role, "content": message.content}
+
+
+def with_id(message: BaseMessage) -> BaseMessage:
+    """Give a message the stable id that `compact()` refers to it by."""
+    if not message.id:
+        message.id = uuid.uuid4().hex
+    return message
+
+
+def content_size(message: BaseMessage) -> int:
+    return len(message.content) if isinstance(message.content, str) else len(str(message.content))
+
+
+class HistoryStore(Protocol):
+    """Per-user chat history backend.
+
+    Implementations must:
+    - keep messages per user in append order, as an append-only log;
+    - return at most the newest `max_messages` messages from `messages()`, oldest first;
+    - make an appended message visible to `messages()` on the same replica immediately,
+      and to other replicas sharing the backend once it has been flushed;
+    - give every appended message an `id` and return it from `messages()`;
+    - keep one running summary per user next to the messages; `compact()` stores a
+      new summary and removes the messages it covers, up to and including the one
+      with id `through`, atomically; if that message is already gone (compacted by
+      another replica, or trimmed) it changes nothing;
+    - drop users (messages and summary) with no activity for `idle_ttl` seconds in `evict_idle()`;
+    - persist anything still buffered in `close()`.
+
+    A Redis-compatible backend maps onto this directly: one list per user
+    (RPUSH + LTRIM to cap, LRANGE to read) plus a summary key, updated together in
+    a WATCHed MULTI block (SET summary + LTRIM away the messages up to `through`), with EXPIRE
+    set to the idle TTL on both.
+    """
+
+    async def append(self, user_id: str, message) -> list[BaseMessage]:
+        """Append a message (dict or LangChain message) and return the user's history."""
+        ...
+
+    async def messages(self, user_id: str) -> list[BaseMessage]:
+        ...
+
+    async def summary(self, user_id: str) -> str:
+        ...
+
+    async def compact(self, user_id: str, summary: str, through: str) -> None:
+        ...
+
+    async def evict_idle(self) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class _UserHistory:
+    __slots__ = ("messages", "summary", "chars", "last_seen")
+
+    def __init__(self, max_messages: int):
+        self.messages = deque(maxlen=max_messages)
+        self.summary = ""
+        self.chars = 0
+        self.last_seen = time.monotonic()
+
+
+class InMemoryHistoryStore:
+    """Bounded per-user chat history held in process memory.
+
+    Each user keeps at most `max_messages` messages (oldest dropped first). Users
+    idle for longer than `idle_ttl` seconds are evicted, and when the store holds
+    more than `max_users` users or `max_chars` characters of content the least
+    recently active users are evicted until it fits again. Messages are converted
+    to LangChain messages once, when appended.
+    """
+
+    def __init__(self, max_messages: int = 50, max_users: int = 10000, idle_ttl: float = 86400, max_chars: int = 50_000_000):
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.idle_ttl = idle_ttl
+        self.max_chars = max_chars
+        self.total_chars = 0
+        self.total_messages = 0
+        self._users = OrderedDict()
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    async def append(self, user_id: str, message) -> list[BaseMessage]:
+        message = with_id(convert_to_messages([message])[0])
+        history = self._users.get(user_id)
+        if history is None:
+            history = self._users[user_id] = _UserHistory(self.max_messages)
+        if len(history.messages) == history.messages.maxlen:
+            dropped = history.messages[0]
+            history.chars -= content_size(dropped)
+            self.total_chars -= content_size(dropped)
+            self.total_messages -= 1
+        history.messages.append(message)
+        history.chars += content_size(message)
+        history.last_seen = time.monotonic()
+        self.total_chars += content_size(message)
+        self.total_messages += 1
+        self._users.move_to_end(user_id)
+        self._evict(keep=user_id)
+        return list(history.messages)
+
+    async def messages(self, user_id: str) -> list[BaseMessage]:
+        history = self._users.get(user_id)
+        return list(history.messages) if history else []
+
+    async def summary(self, user_id: str) -> str:
+        history = self._users.get(user_id)
+        return history.summary if history else ""
+
+    async def compact(self, user_id: str, summary: str, through: str):
+        history = self._users.get(user_id)
+        if history is None or all(message.id != through for message in history.messages):
+            return
+        removed = len(history.summary)
+        while True:
+            message = history.messages.popleft()
+            removed += content_size(message)
+            self.total_messages -= 1
+            if message.id == through:
+                break
+        history.summary = summary
+        history.chars += len(summary) - removed
+        self.total_chars += len(summary) - removed
+        self._evict()
+
+    async def evict_idle(self):
+        """Drop idle users; called periodically so memory is reclaimed without traffic."""
+        self._evict()
+
+    async def close(self):
+        pass
+
+    def _remove(self, user_id: str, reason: str):
+        history = self._users.pop(user_id)
+        self.total_chars -= history.chars
+        self.total_messages -= len(history.messages)
+        HISTORY_EVICTIONS.labels(reason=reason).inc()
+
+    def _evict(self, keep: str | None = None):
+        # Users are ordered by last activity, so expired and LRU users are at the front
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._users:
+            user_id, history = next(iter(self._users.items()))
+            if user_id == keep:
+                break
+            if history.last_seen < cutoff:
+                self._remove(user_id, "idle")
+            elif len(self._users) > self.max_users:
+                self._remove(user_id, "max_users")
+            elif self.total_chars > self.max_chars:
+                self._remove(user_id, "max_chars")
+            else:
+                break
+        HISTORY_USERS.set(len(self._users))
+        HISTORY_MESSAGES.set(self.total_messages)
+        HISTORY_CHARS.set(self.total_chars)
+
+
+# Users whose newest message and summary are both older than the cutoff. A user whose
+# messages were all compacted away is still active while their summary is recent.
+IDLE_USERS = (
+    "SELECT user_id FROM (SELECT user_id, created_at AS at FROM messages "
+    "UNION ALL SELECT user_id, updated_at FROM summaries) GROUP BY user_id HAVING MAX(at) < ?"
+)
+
+
+class SqliteHistoryStore:
+    """Chat history in an SQLite database in WAL mode, shareable between processes.
+
+    Every message is one append-only row. Appends are buffered and written in
+    batches by a background flush task (every `flush_interval` seconds, or sooner
+    once `batch_size` messages are pending); reads on this process merge in the
+    buffered messages, so a user's own turn is visible immediately. Buffered rows
+    stay buffered until their batch is committed, and reads take the buffer and the
+    database rows under the same lock as that commit, so a message is always seen
+    exactly once. Rows beyond the per-user cap and idle users are deleted by `evict_idle()`.
+
+    WAL needs shared memory between processes, so replicas sharing the database
+    must mount the same volume from the same node.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_messages: int = 50,
+        idle_ttl: float = 86400,
+        flush_interval: float = 0.05,
+        batch_size: int = 100,
+    ):
+        self.path = path
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._pending: list[tuple[str, str, str, str, float]] = []
+        self._flush_task = None
+        self._wake = None
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                message_id TEXT,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+        if "message_id" not in columns:
+            # Databases from before message ids: existing rows are named after their row id
+            self._conn.execute("ALTER TABLE messages ADD COLUMN message_id TEXT")
+            self._conn.execute("UPDATE messages SET message_id = 'row-' || id WHERE message_id IS NULL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_user_id ON messages (user_id, id)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                user_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    async def append(self, user_id: str, message) -> list[BaseMessage]:
+        message = with_id(convert_to_messages([message])[0])
+        row = message_to_dict(message)
+        # Wall-clock time so replicas agree on idleness
+        self._pending.append((user_id, message.id, row["role"], str(row["content"]), time.time()))
+        self._ensure_flusher()
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return await self.messages(user_id)
+
+    async def messages(self, user_id: str) -> list[BaseMessage]:
+        rows = await asyncio.to_thread(self._read, user_id)
+        return convert_to_messages(rows[-self.max_messages:])
+
+    async def summary(self, user_id: str) -> str:
+        return await asyncio.to_thread(self._read_summary, user_id)
+
+    async def compact(self, user_id: str, summary: str, through: str):
+        # The compacted messages must be in the database before they can be deleted
+        await self.flush()
+        await asyncio.to_thread(self._compact, user_id, summary, through)
+
+    async def evict_idle(self):
+        await self.flush()
+        await asyncio.to_thread(self._trim)
+
+    async def flush(self):
+        if self._pending:
+            await asyncio.to_thread(self._write)
+
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def _ensure_flusher(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._wake = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except sqlite3.Error as e:
+                # The batch is still buffered and is retried on the next flush
+                print(f"Flushing chat history failed: {e}")
+
+    def _read(self, user_id: str) -> list[dict]:
+        """Stored then buffered messages of a user; the lock keeps a batch from moving between the two."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message_id, role, content FROM messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (user_id, self.max_messages),
+            ).fetchall()
+            pending = [row[1:4] for row in list(self._pending) if row[0] == user_id]
+        return [
+            {"id": message_id, "role": role, "content": content}
+            for message_id, role, content in list(reversed(rows)) + pending
+        ]
+
+    def _read_summary(self, user_id: str) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else ""
+
+    def _compact(self, user_id: str, summary: str, through: str):
+        with self._lock:
+            # IMMEDIATE takes the write lock before the lookup, so another replica cannot
+            # compact or trim between finding the boundary and deleting up to it
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM messages WHERE user_id = ? AND message_id = ?", (user_id, through)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("ROLLBACK")
+                    return
+                self._conn.execute("DELETE FROM messages WHERE user_id = ? AND id <= ?", (user_id, row[0]))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO summaries (user_id, summary, updated_at) VALUES (?, ?, ?)",
+                    (user_id, summary, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _write(self):
+        with self._lock:
+            # Taken under the lock, so concurrent flushes never write the same rows; appends
+            # only extend the buffer, so the batch stays its prefix until it is removed below
+            batch = list(self._pending)
+            if not batch:
+                return
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO messages (user_id, message_id, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                    batch,
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            # Unbuffered only once committed, under the lock readers take
+            del self._pending[:len(batch)]
+
+    def _trim(self):
+        cutoff = time.time() - self.idle_ttl
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                idle = self._conn.execute(f"SELECT COUNT(*) FROM ({IDLE_USERS})", (cutoff,)).fetchone()[0]
+                self._conn.execute(f"DELETE FROM messages WHERE user_id IN ({IDLE_USERS})", (cutoff,))
+                # With the messages gone, an idle user is still selected by their old summary
+                self._conn.execute(f"DELETE FROM summaries WHERE user_id IN ({IDLE_USERS})", (cutoff,))
+                self._conn.execute(
+                    "DELETE FROM messages WHERE id IN (SELECT id FROM "
+                    "(SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id DESC) AS position FROM messages) "
+                    "WHERE position > ?)",
+                    (self.max_messages,),
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            users = self._conn.execute(
+                "SELECT COUNT(*) FROM (SELECT user_id FROM messages UNION SELECT user_id FROM summaries)"
+            ).fetchone()[0]
+            count, chars = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(content)), 0) FROM messages"
+            ).fetchone()
+        if idle:
+            HISTORY_EVICTIONS.labels(reason="idle").inc(idle)
+        HISTORY_USERS.set(users)
+        HISTORY_MESSAGES.set(count)
+        HISTORY_CHARS.set(chars)
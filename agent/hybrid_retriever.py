@@ -0,0 +1,87 @@
+import asyncio
+from typing import Optional
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+from bm25_index import BM25Index
+from tracing import run_span
+from vector_store import MatrixVectorStore
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], rrf_k: int = 60) -> dict[str, float]:
+    """Fuse several ranked id lists: each id scores sum(1 / (rrf_k + rank))."""
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return fused
+
+
+def with_similarity(doc: Document, similarity: float) -> Document:
+    return Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "similarity": similarity})
+
+
+class HybridRetriever(BaseRetriever):
+    """Retrieve by fusing vector similarity and BM25 keyword rankings with RRF.
+
+    Embedding search misses exact terms such as status codes and header names;
+    BM25 catches them, and reciprocal rank fusion combines both rankings without
+    having to calibrate their scores against each other. Without a BM25 index it
+    returns the plain vector ranking.
+
+    Returned documents are copies whose metadata carries the query's cosine
+    `similarity`, which the pre-grader uses to skip clear-cut LLM grading calls.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: MatrixVectorStore
+    bm25: Optional[BM25Index] = None
+    k: int = 4
+    # How many candidates each ranking contributes to the fusion
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: MatrixVectorStore, keyword_search: bool = True, **kwargs) -> "HybridRetriever":
+        bm25 = BM25Index([doc.page_content for doc in vectorstore.documents]) if keyword_search else None
+        return cls(vectorstore=vectorstore, bm25=bm25, **kwargs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        with run_span(run_manager):
+            query_vector = self.vectorstore.embedding.embed_query(query)
+        return self._rank(query, query_vector)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        # The embedding request is awaited here rather than in an executor thread,
+        # so cancelling the retrieval at the turn's deadline cancels the request too
+        with run_span(run_manager):
+            query_vector = await self.vectorstore.embedding.aembed_query(query)
+        return await asyncio.to_thread(self._rank, query, query_vector)
+
+    def _rank(self, query: str, query_vector: list[float]) -> list[Document]:
+        if self.bm25 is None:
+            vector_hits = self.vectorstore.search_by_vectors([query_vector], self.k)[0]
+            return [with_similarity(doc, score) for doc, score in vector_hits]
+        vector_hits = self.vectorstore.search_by_vectors([query_vector], self.fetch_k)[0]
+        keyword_hits = self.bm25.search(query, self.fetch_k)
+        similarities = {doc.id: score for doc, score in vector_hits}
+        documents = {doc.id: doc for doc, _ in vector_hits}
+        keyword_only = [position for position, _ in keyword_hits
+                        if self.vectorstore.documents[position].id not in similarities]
+        if keyword_only:
+            for position, score in zip(keyword_only, self.vectorstore.similarity(query_vector, keyword_only)):
+                doc = self.vectorstore.documents[position]
+                documents[doc.id] = doc
+                similarities[doc.id] = float(score)
+        fused = reciprocal_rank_fusion([
+            [doc.id for doc, _ in vector_hits],
+            [self.vectorstore.documents[position].id for position, _ in keyword_hits],
+        ], self.rrf_k)
+        ranked = sorted(fused, key=fused.get, reverse=True)[: self.k]
+        return [with_similarity(documents[doc_id], similarities[doc_id]) for doc_id in ranked]
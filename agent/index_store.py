@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import NamedTuple
+import numpy as np
+from langchain_core.documents import Document
+
+# Bump whenever the on-disk layout changes so stale snapshots are rebuilt
+SNAPSHOT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+CHUNKS_FILE = "chunks.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+SOURCES_FILE = "sources.json"
+
+
+class IndexSnapshot(NamedTuple):
+    documents: list
+    embeddings: np.ndarray
+    # Per-URL validators (ETag, Last-Modified) and content, used for conditional re-fetches
+    sources: dict
+
+
+def snapshot_key(urls, embedding_model, chunk_size, chunk_overlap, token_encoding):
+    """Return a fingerprint of everything that determines the index contents."""
+    payload = json.dumps(
+        {
+            "version": SNAPSHOT_VERSION,
+            "urls": sorted(urls),
+            "embedding_model": embedding_model,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            # Chunk sizes are counted in tokens of this encoding, so it shapes the chunks too
+            "token_encoding": token_encoding,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_snapshot(path, key):
+    """Load an IndexSnapshot from a snapshot directory.
+
+    Returns None when there is no snapshot, it was written by another
+    snapshot version, or it was built for a different source set.
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != SNAPSHOT_VERSION or manifest.get("key") != key:
+            return None
+        with open(os.path.join(path, CHUNKS_FILE), "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), allow_pickle=False)
+        sources_path = os.path.join(path, SOURCES_FILE)
+        sources = {}
+        if os.path.exists(sources_path):
+            with open(sources_path, "r", encoding="utf-8") as f:
+                sources = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable index snapshot at {path}: {e}")
+        return None
+    if len(chunks) != manifest.get("count") or embeddings.shape[0] != len(chunks):
+        print(f"Ignoring inconsistent index snapshot at {path}")
+        return None
+    documents = [
+        Document(id=c.get("id"), page_content=c["page_content"], metadata=c["metadata"])
+        for c in chunks
+    ]
+    return IndexSnapshot(documents, embeddings, sources)
+
+
+def save_snapshot(path, key, documents, embeddings, sources=None):
+    """Write documents, their embedding matrix and source validators to a snapshot directory.
+
+    The snapshot is written to a sibling temp directory and swapped into place,
+    so a crash mid-write never leaves a half-written snapshot behind.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=".snapshot-", dir=parent)
+    try:
+        chunks = [
+            {"id": d.id, "page_content": d.page_content, "metadata": d.metadata}
+            for d in documents
+        ]
+        with open(os.path.join(tmp_path, CHUNKS_FILE), "w", encoding="utf-8") as f:
+            json.dump(chunks, f)
+        np.save(os.path.join(tmp_path, EMBEDDINGS_FILE), embeddings, allow_pickle=False)
+        with open(os.path.join(tmp_path, SOURCES_FILE), "w", encoding="utf-8") as f:
+            json.dump(sources or {}, f)
+        # The manifest goes last: its presence marks the snapshot as complete
+        with open(os.path.join(tmp_path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": SNAPSHOT_VERSION,
+                    "key": key,
+                    "count": len(chunks),
+                    "dimensions": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+                },
+                f,
+            )
+        old_path = None
+        if os.path.exists(path):
+            old_path = tmp_path + ".old"
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        if old_path:
+            shutil.rmtree(old_path, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
@@ -0,0 +1,107 @@
+import time
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Histogram
+
+LLM_LATENCY = Histogram(
+    'llm_call_duration_seconds', 'Duration of one LLM call', ['node', 'model'],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+LLM_TOKENS = Histogram(
+    'llm_call_tokens', 'Tokens of one LLM call by kind (prompt, completion)', ['node', 'model', 'kind'],
+    buckets=(16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+RETRIEVAL_LATENCY = Histogram(
+    'retrieval_duration_seconds', 'Duration of one retriever call', ['node'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def token_usage(response):
+    """(prompt, completion) token counts of an LLMResult, or None when the provider sent none."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage")
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return None
+
+
+class RunTimingHandler(BaseCallbackHandler):
+    """Time each LLM and retriever run and hand it to the `*_finished` hooks of a subclass.
+
+    Runs are labeled with their LangGraph node and model. Pass the handler in the
+    callbacks of a graph run; child runs inherit it.
+    """
+
+    # Only does dictionary work, so it runs on the event loop instead of an executor
+    run_inline = True
+
+    def __init__(self):
+        # run_id -> (start, node, model)
+        self._runs = {}
+
+    def _start(self, run_id, metadata, model=None):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node", "none")
+        self._runs[run_id] = (time.perf_counter(), node, model or metadata.get("ls_model_name", "unknown"))
+
+    def _finish(self, run_id):
+        """(node, model, seconds) of a finished run, or None when its start was not seen."""
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        start, node, model = run
+        return node, model, time.perf_counter() - start
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is not None:
+            self.llm_finished(*run, response)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is not None:
+            self.llm_failed(*run, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, metadata, model="retriever")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        run = self._finish(run_id)
+        if run is not None:
+            self.retrieval_finished(run[0], run[2], documents)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def llm_finished(self, node, model, seconds, response):
+        pass
+
+    def llm_failed(self, node, model, seconds, error):
+        pass
+
+    def retrieval_finished(self, node, seconds, documents):
+        pass
+
+
+class MetricsCallbackHandler(RunTimingHandler):
+    """Record LLM and retriever latency and token counts, labeled by LangGraph node and model."""
+
+    def llm_finished(self, node, model, seconds, response):
+        LLM_LATENCY.labels(node=node, model=model).observe(seconds)
+        usage = token_usage(response)
+        if usage is not None:
+            LLM_TOKENS.labels(node=node, model=model, kind="prompt").observe(usage[0])
+            LLM_TOKENS.labels(node=node, model=model, kind="completion").observe(usage[1])
+
+    def retrieval_finished(self, node, seconds, documents):
+        RETRIEVAL_LATENCY.labels(node=node).observe(seconds)
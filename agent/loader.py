@@ -0,0 +1,78 @@
+import asyncio
+import os
+from typing import NamedTuple
+import httpx
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+
+FETCH_TIMEOUT = float(os.getenv("FETCH_TIMEOUT", "15"))
+FETCH_MAX_CONNECTIONS = int(os.getenv("FETCH_MAX_CONNECTIONS", "10"))
+USER_AGENT = os.getenv("USER_AGENT", "guidelines-agent")
+
+
+class FetchedSource(NamedTuple):
+    url: str
+    content: str
+    etag: str | None
+    last_modified: str | None
+    changed: bool
+
+    def validators(self):
+        """Return the state needed to revalidate this source on the next fetch."""
+        return {"etag": self.etag, "last_modified": self.last_modified, "content": self.content}
+
+    def to_document(self):
+        return Document(page_content=self.content, metadata={"source": self.url})
+
+
+def extract_text(response: httpx.Response) -> str:
+    # Raw markdown is indexed as-is; HTML pages are reduced to their text like WebBaseLoader does
+    if "html" in response.headers.get("content-type", ""):
+        return BeautifulSoup(response.text, "html.parser").get_text()
+    return response.text
+
+
+async def fetch_source(client: httpx.AsyncClient, url: str, previous: dict | None, timeout: float) -> FetchedSource:
+    """Fetch one source, sending conditional headers when we have a previous copy.
+
+    A 304 response reuses the previous content. If the fetch fails and a previous
+    copy exists it is reused as well, so one flaky source cannot fail a re-index.
+    """
+    headers = {}
+    if previous:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+    try:
+        response = await asyncio.wait_for(client.get(url, headers=headers), timeout)
+        if response.status_code == 304 and previous:
+            return FetchedSource(url, previous["content"], previous.get("etag"), previous.get("last_modified"), False)
+        response.raise_for_status()
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        if not previous:
+            raise
+        print(f"Fetching {url} failed ({e!r}), reusing previous copy")
+        return FetchedSource(url, previous["content"], previous.get("etag"), previous.get("last_modified"), False)
+    content = extract_text(response)
+    changed = previous is None or previous.get("content") != content
+    return FetchedSource(
+        url,
+        content,
+        response.headers.get("etag"),
+        response.headers.get("last-modified"),
+        changed,
+    )
+
+
+async def fetch_sources(urls, previous=None, timeout: float = FETCH_TIMEOUT) -> list[FetchedSource]:
+    """Fetch all sources concurrently over one pooled client, in the order of `urls`."""
+    previous = previous or {}
+    limits = httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS, max_keepalive_connections=FETCH_MAX_CONNECTIONS)
+    # httpx would otherwise cut connect, read and pool waits off at its 5s default
+    async with httpx.AsyncClient(
+        limits=limits, timeout=httpx.Timeout(timeout), follow_redirects=True, headers={"User-Agent": USER_AGENT}
+    ) as client:
+        return await asyncio.gather(
+            *(fetch_source(client, url, previous.get(url), timeout) for url in urls)
+        )
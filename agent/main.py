@@ -1,24 +1,48 @@
 import getpass
+import json
 import os
 import asyncio
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse, JSONResponse
+import time
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from dotenv import load_dotenv
-from mcp_client import MCPClient
-from langchain_community.document_loaders import WebBaseLoader
+import httpx
+from mcp_client import CircuitOpenError, MCPClient
+import index_store
+import loader
+from vector_store import MatrixVectorStore
+from ann_index import IVFIndex
+from hybrid_retriever import HybridRetriever
+from query_embeddings import CachedQueryEmbeddings
+from context import count_tokens, format_history, get_message_role_content, token_encoding
+from history import InMemoryHistoryStore, SqliteHistoryStore, message_to_dict
+from answer_cache import SemanticAnswerCache, context_fingerprint
+from llm_metrics import MetricsCallbackHandler
+from tracing import TracingCallbackHandler, tracer
+from request_profile import PROFILE_HEADER, ProfileCallbackHandler, RequestProfile, profiling_requested
+from opentelemetry import trace
+import budget
+from budget import DeadlineExceeded, invoke_within
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_openai import OpenAIEmbeddings
+from fake_models import FakeChatModel, FakeEmbeddings
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain.tools.retriever import create_retriever_tool
 from langgraph.graph import MessagesState, StateGraph, START, END
 from langchain.chat_models import init_chat_model
 from pydantic import BaseModel, Field
 from typing import Literal
-from langchain_core.messages import convert_to_messages
+from langchain_core.messages import AIMessageChunk, SystemMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.graph import MermaidDrawMethod
 from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.types import Command
 
 load_dotenv()
 
@@ -32,55 +56,154 @@ urls = [
     "https://raw.githubusercontent.com/cortside/guidelines/refs/heads/master/docs/rest/HTTPStatusCodes.md"
 ]
 
-print(f"Loading documents from URLs: {len(urls)}")
-docs = [WebBaseLoader(url).load() for url in urls]
+CHUNK_SIZE = 100
+CHUNK_OVERLAP = 50
+INDEX_DIR = os.getenv("INDEX_DIR", "index")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+# "exact" searches every chunk; "ivf" uses an approximate inverted-file index for large corpora
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+# "hybrid" fuses BM25 keyword and vector rankings; "vector" uses embeddings only
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+
+# Chunk embeddings are cached on disk keyed by a hash of the chunk text within a
+# per-model namespace, so a re-index only embeds chunks whose text changed.
+# "openai", or "fake" for offline deterministic models with simulated latency (see fake_models.py)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "openai")
+
+base_embeddings = FakeEmbeddings() if MODEL_BACKEND == "fake" else OpenAIEmbeddings()
+embeddings = CacheBackedEmbeddings.from_bytes_store(
+    base_embeddings,
+    LocalFileStore(EMBEDDING_CACHE_DIR),
+    namespace=base_embeddings.model,
+    key_encoder="sha256",
+)
+# Retrieval queries go through an in-memory LRU+TTL cache; see /metrics for hit/miss counts
+query_embeddings = CachedQueryEmbeddings(
+    embeddings,
+    base_embeddings.model,
+    maxsize=int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "3600")),
+)
 
-# Flatten the list of lists into a single list of documents
-docs_list = [item for sublist in docs for item in sublist]
 
-text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-    chunk_size=100, chunk_overlap=50
+def split_and_embed(docs_list):
+    """Split the guideline documents into chunks and embed every chunk."""
+    encoding = token_encoding()
+    if encoding == "words":
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=count_tokens
+        )
+    else:
+        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name=encoding, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+        )
+    doc_splits = text_splitter.split_documents(docs_list)
+    for doc in doc_splits:
+        doc.id = str(uuid.uuid4())
+    vectors = embeddings.embed_documents([doc.page_content for doc in doc_splits])
+    return doc_splits, vectors
+
+
+async def build_index(refresh=False):
+    """Return the retriever over the vector store, from the snapshot when possible, and whether its content changed.
+
+    With refresh=True the sources are revalidated with conditional requests and
+    the index is only rebuilt when at least one of them changed; when none did,
+    `changed` is False and the snapshot's store is returned.
+    """
+    index_key = index_store.snapshot_key(urls, base_embeddings.model, CHUNK_SIZE, CHUNK_OVERLAP, token_encoding())
+    snapshot = await asyncio.to_thread(index_store.load_snapshot, INDEX_DIR, index_key)
+    changed = True
+    if snapshot and not refresh:
+        print(f"Loaded index snapshot from {INDEX_DIR}")
+        doc_splits, vectors = snapshot.documents, snapshot.embeddings
+    else:
+        print(f"Loading documents from URLs: {len(urls)}")
+        sources = await loader.fetch_sources(urls, snapshot.sources if snapshot else None)
+        if snapshot and not any(source.changed for source in sources):
+            print("Sources unchanged, keeping index snapshot")
+            doc_splits, vectors = snapshot.documents, snapshot.embeddings
+            changed = False
+        else:
+            docs_list = [source.to_document() for source in sources]
+            doc_splits, vectors = await asyncio.to_thread(split_and_embed, docs_list)
+            await asyncio.to_thread(
+                index_store.save_snapshot,
+                INDEX_DIR,
+                index_key,
+                doc_splits,
+                vectors,
+                {source.url: source.validators() for source in sources},
+            )
+            print(f"Saved index snapshot to {INDEX_DIR}")
+
+    print(f"Number of documents in vectorstore: {len(urls)}")
+    print(f"Number of chunks: {len(doc_splits)}")
+    # Normalizing the matrix, training the IVF centroids and tokenizing every chunk for
+    # BM25 are CPU-bound; off the loop, requests keep being served meanwhile
+    return await asyncio.to_thread(build_retriever, doc_splits, vectors), changed
+
+
+def build_retriever(doc_splits, vectors) -> HybridRetriever:
+    index = IVFIndex(nlist=IVF_NLIST, nprobe=IVF_NPROBE) if VECTOR_INDEX == "ivf" else None
+    store = MatrixVectorStore.from_embeddings(doc_splits, vectors, query_embeddings, index)
+    return HybridRetriever.from_vectorstore(store, keyword_search=RETRIEVAL_MODE == "hybrid")
+
+
+# The retriever and graph are built by a background task at startup; see lifespan()
+vectorstore = None
+retriever_tool = None
+graph = None
+index_generation = 0
+reindex_task = None
+
+answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
 )
-doc_splits = text_splitter.split_documents(docs_list)
 
-vectorstore = InMemoryVectorStore.from_documents(
-    documents=doc_splits, embedding=OpenAIEmbeddings()
-)
-retriever = vectorstore.as_retriever()
+response_model = FakeChatModel() if MODEL_BACKEND == "fake" else init_chat_model("openai:gpt-4.1", temperature=0)
 
-print(f"Number of documents in vectorstore: {len(urls)}")
-print(f"Number of chunks: {len(doc_splits)}")
+# Token budgets for the conversation history appended to each node's prompt (0 = unlimited)
+GRADER_HISTORY_TOKENS = int(os.getenv("GRADER_HISTORY_TOKENS", "1000"))
+REWRITER_HISTORY_TOKENS = int(os.getenv("REWRITER_HISTORY_TOKENS", "1000"))
+GENERATOR_HISTORY_TOKENS = int(os.getenv("GENERATOR_HISTORY_TOKENS", "2000"))
 
-retriever_tool = create_retriever_tool(
-    retriever,
-    "retrieve_blog_posts",
-    "Search and return information about guidelines.",
-)
 
-response_model = init_chat_model("openai:gpt-4.1", temperature=0)
+def prompt_history(messages, max_tokens, summary, config: RunnableConfig):
+    """format_history, timed into the request's profile (if the run has one) as history assembly."""
+    started = time.perf_counter()
+    history_text = format_history(messages, max_tokens, summary)
+    profile = config.get("configurable", {}).get("profile")
+    if profile:
+        profile.add_stage("history_assembly", time.perf_counter() - started)
+    return history_text
 
 
-def get_message_role_content(m):
-    if isinstance(m, dict):
-        role = m.get("role", "user")
-        content = m.get("content", str(m))
-    else:
-        role = getattr(m, "type", "user")
-        content = getattr(m, "content", str(m))
-    return f"{role}: {content}"
+class AgentState(MessagesState):
+    # Running summary of the user's compacted older turns
+    summary: str
+    # time.monotonic() by which the run has to produce its answer
+    deadline: float
+    # Times rewrite_question has run in this turn
+    rewrites: int
 
 
-def generate_query_or_respond(state: MessagesState):
+async def generate_query_or_respond(state: AgentState):
     """Call the model to generate a response based on the current state. Given
     the question, it will decide to retrieve using the retriever tool, or simply respond to the user.
-    Now uses the full message history for context."""
+    Now uses the full message history for context. With only time left for answering,
+    the model gets no tools, so it has to answer instead of retrieving again."""
     # Use all messages for context
     messages = state["messages"]
     print(f"User messages: {[m.content for m in messages]}")
-    response = (
-        response_model
-        .bind_tools([retriever_tool]).invoke(messages)
-    )
+    if state.get("summary"):
+        messages = [SystemMessage(content=f"Summary of earlier conversation: {state['summary']}")] + messages
+    model = response_model if budget.out_of_time(state) else response_model.bind_tools([retriever_tool])
+    response = await invoke_within(model, messages, state)
     print(f"Response from model: {response}")
     return {"messages": [response]}
 
@@ -101,30 +224,65 @@ class GradeDocuments(BaseModel):
     )
 
 
-def grade_documents(
-    state: MessagesState,
-) -> Literal["generate_answer", "rewrite_question"]:
-    """Determine whether the retrieved documents are relevant to the question, using full history."""
+# Retrieval similarity at or above PREGRADE_ACCEPT is relevant and below PREGRADE_REJECT
+# is not, without asking the model; scores in between go to the LLM grader. The right
+# values depend on the embedding model, so calibrate them against real questions. Cosine
+# similarity lies in [-1, 1], so the defaults never decide: every turn goes to the LLM
+# grader until thresholds are set.
+PREGRADE_ACCEPT = float(os.getenv("PREGRADE_ACCEPT", "2"))
+PREGRADE_REJECT = float(os.getenv("PREGRADE_REJECT", "-1"))
+
+
+def pregrade(message) -> Literal["generate_answer", "rewrite_question"] | None:
+    """Grade from the best retrieval similarity, or return None when the LLM has to decide."""
+    documents = getattr(message, "artifact", None) or []
+    similarities = [d.metadata["similarity"] for d in documents if "similarity" in d.metadata]
+    if not similarities:
+        return None
+    best = max(similarities)
+    if best >= PREGRADE_ACCEPT:
+        return "generate_answer"
+    if best < PREGRADE_REJECT:
+        return "rewrite_question"
+    return None
+
+
+async def grade_documents(
+    state: AgentState, config: RunnableConfig
+) -> Command[Literal["generate_answer", "rewrite_question"]]:
+    """Determine whether the retrieved documents are relevant to the question, using full history.
+    Out of rewrites or time, answer from what was retrieved without grading it.
+    A node of its own, so its time and LLM calls are not counted as retrieval."""
     messages = state["messages"]
+    if budget.nearly_spent(state):
+        GRADING_DECISIONS.labels(path="budget").inc()
+        return Command(goto="generate_answer")
+    decision = pregrade(messages[-1])
+    if decision is not None:
+        GRADING_DECISIONS.labels(path="accept" if decision == "generate_answer" else "reject").inc()
+        return Command(goto=decision)
+    GRADING_DECISIONS.labels(path="llm").inc()
     question = messages[0].content
     context = messages[-1].content
-    history_text = "\n".join([get_message_role_content(m) for m in messages[:-1]])
+    history_text = prompt_history(messages[:-1], GRADER_HISTORY_TOKENS, state.get("summary", ""), config)
     prompt = (
         GRADE_PROMPT +
         (f"\nConversation history:\n{history_text}" if history_text else "")
     ).format(question=question, context=context)
     print(f"Grading prompt: {prompt}")
-    response = response_model.with_structured_output(GradeDocuments).invoke(
-        [{"role": "user", "content": prompt}]
+    response = await invoke_within(
+        response_model.with_structured_output(GradeDocuments),
+        [{"role": "user", "content": prompt}],
+        state,
     )
     # Fix: Access binary_score correctly for both dict and BaseModel
     score = getattr(response, "binary_score", None)
     if score is None and isinstance(response, dict):
         score = response.get("binary_score")
     if score == "yes":
-        return "generate_answer"
+        return Command(goto="generate_answer")
     else:
-        return "rewrite_question"
+        return Command(goto="rewrite_question")
 
 REWRITE_PROMPT = (
     "Look at the input and try to reason about the underlying semantic intent / meaning.\n"
@@ -136,16 +294,16 @@ REWRITE_PROMPT = (
 )
 
 
-def rewrite_question(state: MessagesState):
+async def rewrite_question(state: AgentState, config: RunnableConfig):
     """Rewrite the original user question, using full history."""
     messages = state["messages"]
-    history_text = "\n".join([get_message_role_content(m) for m in messages])
+    history_text = prompt_history(messages, REWRITER_HISTORY_TOKENS, state.get("summary", ""), config)
     prompt = (
         REWRITE_PROMPT +
         f"\nConversation history:\n{history_text}"
     ).format(question=messages[0].content)
-    response = response_model.invoke([{"role": "user", "content": prompt}])
-    return {"messages": [{"role": "user", "content": response.content}]}
+    response = await invoke_within(response_model, [{"role": "user", "content": prompt}], state)
+    return {"messages": [{"role": "user", "content": response.content}], "rewrites": state.get("rewrites", 0) + 1}
 
 GENERATE_PROMPT = (
     "You are an assistant for question-answering tasks. "
@@ -157,60 +315,216 @@ GENERATE_PROMPT = (
 )
 
 
-def generate_answer(state: MessagesState):
+async def generate_answer(state: AgentState, config: RunnableConfig):
     """Generate an answer, using full history."""
     messages = state["messages"]
     question = messages[0].content
     context = messages[-1].content
-    history_text = "\n".join([get_message_role_content(m) for m in messages])
+    history_text = prompt_history(messages, GENERATOR_HISTORY_TOKENS, state.get("summary", ""), config)
     prompt = (
         GENERATE_PROMPT +
         f"\nConversation history:\n{history_text}"
     ).format(question=question, context=context)
     print(f"Answer generation prompt: {prompt}")
-    response = response_model.invoke([{"role": "user", "content": prompt}])
+    response = await invoke_within(response_model, [{"role": "user", "content": prompt}], state)
     print(f"Generated answer: {response.content}")
     # Return the response as a message
     return {"messages": [response]}
 
-workflow = StateGraph(MessagesState)
-
-# Define the nodes we will cycle between
-workflow.add_node(generate_query_or_respond)
-workflow.add_node("retrieve", ToolNode([retriever_tool]))
-workflow.add_node(rewrite_question)
-workflow.add_node(generate_answer)
-
-workflow.add_edge(START, "generate_query_or_respond")
-
-# Decide whether to retrieve
-workflow.add_conditional_edges(
-    "generate_query_or_respond",
-    # Assess LLM decision (call `retriever_tool` tool or respond to the user)
-    tools_condition,
-    {
-        # Translate the condition outputs to nodes in our graph
-        "tools": "retrieve",
-        END: END,
-    },
+SUMMARY_PROMPT = (
+    "Summarize the conversation below so the summary can replace it in later prompts. "
+    "Keep the user's goals, the questions asked, facts established and decisions made. "
+    "Use at most {words} words.\n"
+    "Previous summary: {summary}\n"
+    "Conversation:\n{history}"
 )
 
-# Edges taken after the `action` node is called.
-workflow.add_conditional_edges(
-    "retrieve",
-    # Assess agent decision
-    grade_documents,
-)
-workflow.add_edge("generate_answer", END)
-workflow.add_edge("rewrite_question", "generate_query_or_respond")
 
-# Compile
-graph = workflow.compile()
+async def compact_history(user_id):
+    """Fold a user's older messages into their running summary, off the request path."""
+    try:
+        messages = await chat_history.messages(user_id)
+        # Not messages[:-HISTORY_KEEP_RECENT], which is empty when keeping none
+        older = messages[:max(0, len(messages) - HISTORY_KEEP_RECENT)]
+        if not older:
+            return
+        summary = await chat_history.summary(user_id)
+        prompt = SUMMARY_PROMPT.format(
+            words=HISTORY_SUMMARY_WORDS,
+            summary=summary or "(none)",
+            history=format_history(older, 0),
+        )
+        # Bounded, so a hung call cannot hold the user's compaction slot forever
+        response = await invoke_within(
+            response_model,
+            [{"role": "user", "content": prompt}],
+            {"deadline": budget.new_deadline(HISTORY_SUMMARY_TIMEOUT)},
+        )
+        # By the last summarized message, not a count: other replicas may have compacted or
+        # trimmed this user meanwhile, and only what this summary covers is removed
+        await chat_history.compact(user_id, response.content, older[-1].id)
+        print(f"Compacted {len(older)} messages of {user_id} into the summary")
+    except DeadlineExceeded:
+        print(f"History compaction for {user_id} timed out after {HISTORY_SUMMARY_TIMEOUT}s")
+    except Exception as e:
+        print(f"History compaction for {user_id} failed: {e}")
+    finally:
+        compactions.pop(user_id, None)
+
+
+def schedule_compaction(user_id, history_length):
+    if HISTORY_SUMMARY_AFTER <= 0 or history_length <= HISTORY_SUMMARY_AFTER or user_id in compactions:
+        return
+    compactions[user_id] = asyncio.create_task(compact_history(user_id))
+
+
+def within_deadline(node):
+    """Wrap a runnable node so its run is cancelled at the turn's deadline."""
+    async def run(state: AgentState, config: RunnableConfig):
+        return await budget.within(node.ainvoke(state, config), state)
+    return run
+
+
+def build_graph(tool):
+    """Build and compile the agentic RAG workflow around the given retriever tool."""
+    workflow = StateGraph(AgentState)
+
+    # Define the nodes we will cycle between
+    workflow.add_node(generate_query_or_respond)
+    # Retrieval embeds the query, so it is bounded by the deadline like the model calls
+    workflow.add_node("retrieve", within_deadline(ToolNode([tool])))
+    workflow.add_node(grade_documents)
+    workflow.add_node(rewrite_question)
+    workflow.add_node(generate_answer)
+
+    workflow.add_edge(START, "generate_query_or_respond")
+
+    # Decide whether to retrieve
+    workflow.add_conditional_edges(
+        "generate_query_or_respond",
+        # Assess LLM decision (call `retriever_tool` tool or respond to the user)
+        tools_condition,
+        {
+            # Translate the condition outputs to nodes in our graph
+            "tools": "retrieve",
+            END: END,
+        },
+    )
+
+    # grade_documents routes to generate_answer or rewrite_question itself
+    workflow.add_edge("retrieve", "grade_documents")
+    workflow.add_edge("generate_answer", END)
+    workflow.add_edge("rewrite_question", "generate_query_or_respond")
+
+    # Compile
+    return workflow.compile()
+
 
-with open("workflow.png", "wb") as f:
-    f.write(graph.get_graph().draw_mermaid_png())
+# Diagrams of the current workflow graph by format, rendered on first request to /debug/workflow
+workflow_diagrams = {}
 
-app = FastAPI()
+
+def render_workflow(diagram_format):
+    drawable = graph.get_graph()
+    if diagram_format == "mermaid":
+        return drawable.draw_mermaid()
+    try:
+        import pyppeteer  # noqa: F401
+    except ImportError:
+        # Falls back to the mermaid.ink web service
+        return drawable.draw_mermaid_png()
+    return drawable.draw_mermaid_png(draw_method=MermaidDrawMethod.PYPPETEER)
+
+
+async def load_index(refresh=False):
+    """Build the retriever and workflow graph and swap them in, unless the index is unchanged."""
+    global vectorstore, retriever_tool, graph, index_generation
+    retriever, changed = await build_index(refresh)
+    if not changed and graph is not None:
+        # Same chunks as the index being served, so its graph and cached answers stay valid
+        return
+    # The retrieved documents (with their similarity scores) ride along as the
+    # ToolMessage artifact for the pre-grader
+    tool = create_retriever_tool(
+        retriever,
+        "retrieve_blog_posts",
+        "Search and return information about guidelines.",
+        response_format="content_and_artifact",
+    )
+    compiled = build_graph(tool)
+    vectorstore, retriever_tool, graph = retriever.vectorstore, tool, compiled
+    index_generation += 1
+    workflow_diagrams.clear()
+    # Cached answers were grounded in the previous index
+    answer_cache.clear()
+
+
+# Attempts at building the index, and the delay before the first retry (doubled after each failure)
+INDEX_BUILD_ATTEMPTS = int(os.getenv("INDEX_BUILD_ATTEMPTS", "5"))
+INDEX_BUILD_BACKOFF = float(os.getenv("INDEX_BUILD_BACKOFF", "5"))
+# Why the startup build gave up; /health fails while it is set so the process gets restarted
+index_error = None
+
+
+async def load_index_in_background(refresh=False):
+    """Load the index, retrying failed builds with exponential backoff.
+
+    A reindex that keeps failing leaves the previous index serving; a startup
+    build that does sets `index_error`.
+    """
+    global index_error
+    for attempt in range(1, INDEX_BUILD_ATTEMPTS + 1):
+        try:
+            await load_index(refresh)
+            index_error = None
+            print("Index loaded, agent is ready")
+            return
+        except Exception as e:
+            print(f"Index build failed (attempt {attempt} of {INDEX_BUILD_ATTEMPTS}): {e}")
+            if attempt < INDEX_BUILD_ATTEMPTS:
+                await asyncio.sleep(INDEX_BUILD_BACKOFF * 2 ** (attempt - 1))
+            elif graph is None:
+                index_error = f"{type(e).__name__}: {e}"
+
+
+async def sweep_history():
+    while True:
+        await asyncio.sleep(60)
+        await chat_history.evict_idle()
+
+
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.1"))
+
+
+async def monitor_event_loop():
+    """Observe how late a fixed-interval sleep wakes up, i.e. how long the loop was blocked."""
+    while True:
+        scheduled = time.perf_counter() + EVENT_LOOP_LAG_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, time.perf_counter() - scheduled))
+
+
+# Process-wide MCP client, opened and closed with the app
+mcp_client = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global mcp_client
+    mcp_client = MCPClient()
+    # Build the index off the request path so /health answers while embedding runs
+    task = asyncio.create_task(load_index_in_background())
+    sweeper = asyncio.create_task(sweep_history())
+    lag_monitor = asyncio.create_task(monitor_event_loop())
+    yield
+    task.cancel()
+    sweeper.cancel()
+    lag_monitor.cancel()
+    await chat_history.close()
+    await mcp_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # You can restrict this to your frontend domain
@@ -224,72 +538,353 @@ FastAPIInstrumentor().instrument_app(app)
 CHAT_REQUESTS = Counter('chat_requests_total', 'Total chat requests')
 CHAT_RESPONSES = Counter('chat_responses_total', 'Total chat responses')
 HEALTH_CHECKS = Counter('health_checks_total', 'Total health checks')
+READY_CHECKS = Counter('ready_checks_total', 'Total readiness checks')
+GRADING_DECISIONS = Counter('grading_decisions_total', 'Relevance grading decisions by path', ['path'])
+DEADLINES_EXCEEDED = Counter('chat_deadlines_exceeded_total', 'Chat turns that ran out of their time budget')
+CHAT_LATENCY = Histogram(
+    'chat_turn_duration_seconds', 'Duration of a chat turn by outcome (answered, cached, timed_out, empty)', ['outcome'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+NODE_LATENCY = Histogram(
+    'graph_node_duration_seconds', 'Duration of one workflow node run', ['node'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30),
+)
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds', 'How late the event loop ran a scheduled wake-up',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+REWRITE_ITERATIONS = Histogram(
+    'chat_rewrite_iterations', 'Question rewrites per chat turn', buckets=(0, 1, 2, 3, 4, 5)
+)
+
+# Bounded chat history per user; "sqlite" shares it between replicas through a mounted volume
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "memory")
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "50"))
+HISTORY_IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL", "86400"))
+# Once a user has more than HISTORY_SUMMARY_AFTER messages (0 disables), all but the
+# newest HISTORY_KEEP_RECENT are folded into a running summary in the background
+HISTORY_SUMMARY_AFTER = int(os.getenv("HISTORY_SUMMARY_AFTER", "20"))
+HISTORY_KEEP_RECENT = int(os.getenv("HISTORY_KEEP_RECENT", "10"))
+HISTORY_SUMMARY_WORDS = int(os.getenv("HISTORY_SUMMARY_WORDS", "200"))
+HISTORY_SUMMARY_TIMEOUT = float(os.getenv("HISTORY_SUMMARY_TIMEOUT", "60"))
+compactions = {}
+
+if HISTORY_BACKEND == "sqlite":
+    chat_history = SqliteHistoryStore(
+        os.getenv("HISTORY_DB_PATH", "history/history.db"),
+        max_messages=HISTORY_MAX_MESSAGES,
+        idle_ttl=HISTORY_IDLE_TTL,
+        flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.05")),
+        batch_size=int(os.getenv("HISTORY_BATCH_SIZE", "100")),
+    )
+else:
+    chat_history = InMemoryHistoryStore(
+        max_messages=HISTORY_MAX_MESSAGES,
+        max_users=int(os.getenv("HISTORY_MAX_USERS", "10000")),
+        idle_ttl=HISTORY_IDLE_TTL,
+        max_chars=int(os.getenv("HISTORY_MAX_CHARS", "50000000")),
+    )
+
+def ensure_ready():
+    if graph is None:
+        raise HTTPException(status_code=503, detail="Index is still loading")
+
+
+# Nodes whose model tokens are forwarded to streaming clients
+STREAMED_NODES = {"generate_query_or_respond", "generate_answer"}
+
+
+def message_content(message):
+    if isinstance(message, dict):
+        return message.get("content", "")
+    return getattr(message, "content", str(message))
+
+
+async def stream_graph(lc_messages, summary="", deadline=None, trace_context=None, profile=None):
+    """Run the workflow graph and yield node_started, token, node_finished and final events.
+
+    The final event has no answer and sets `timed_out` when an LLM call hit the deadline.
+    Spans of the run's nodes and calls hang under `trace_context` (default: the current span),
+    and node, LLM and retrieval timings are recorded into `profile` when one is given.
+    """
+    answer = None
+    try:
+        async for event in _graph_events(lc_messages, summary, deadline, trace_context, profile):
+            if event["type"] == "answer":
+                answer = event["answer"]
+            else:
+                yield event
+    except DeadlineExceeded:
+        DEADLINES_EXCEEDED.inc()
+        yield {"type": "final", "answer": None, "timed_out": True}
+        return
+    yield {"type": "final", "answer": answer}
+
+
+async def _graph_events(lc_messages, summary, deadline, trace_context, profile):
+    # Task id -> start time, for the node duration histogram
+    started = {}
+    rewrites = 0
+    callbacks = [MetricsCallbackHandler(), TracingCallbackHandler(trace_context)]
+    if profile:
+        callbacks.append(ProfileCallbackHandler(profile))
+    async for mode, payload in graph.astream(
+        {"messages": lc_messages, "summary": summary, "deadline": deadline, "rewrites": 0},
+        {"recursion_limit": budget.recursion_limit(), "callbacks": callbacks, "configurable": {"profile": profile}},
+        stream_mode=["tasks", "messages", "updates"],
+    ):
+        if mode == "tasks":
+            # Task events carry "input" when a node starts and "result" when it finishes
+            if "input" in payload:
+                started[payload["id"]] = time.perf_counter()
+                yield {"type": "node_started", "node": payload["name"]}
+            elif payload["id"] in started:
+                seconds = time.perf_counter() - started.pop(payload["id"])
+                NODE_LATENCY.labels(node=payload["name"]).observe(seconds)
+                if profile:
+                    profile.add_node(payload["name"], seconds)
+                if payload["name"] == "rewrite_question":
+                    rewrites += 1
+        elif mode == "messages":
+            chunk, metadata = payload
+            node = metadata.get("langgraph_node")
+            if node in STREAMED_NODES and isinstance(chunk, AIMessageChunk) and chunk.content:
+                yield {"type": "token", "node": node, "content": chunk.content}
+        elif mode == "updates":
+            for node, update in payload.items():
+                if update and update.get("messages"):
+                    yield {"type": "answer", "answer": message_content(update["messages"][-1])}
+                yield {"type": "node_finished", "node": node}
+    REWRITE_ITERATIONS.observe(rewrites)
+
+
+TIMED_OUT_ANSWER = "Sorry, answering took too long. Please try again."
+
+
+async def chat_turn(user_id, message, profile=None):
+    """Record the user's message and yield the events of answering it.
+
+    With a RequestProfile, the final event also carries its timing breakdown as `profile`.
+    """
+    # The turn's budget starts with the request, before history and embedding lookups
+    deadline = budget.new_deadline()
+    started = time.perf_counter()
+    # Started without making it current: a generator may be resumed from another
+    # context, so it is only made current around awaits, never across a yield
+    span = tracer.start_span("chat_turn")
+    try:
+        with trace.use_span(span, end_on_exit=False):
+            user_messages = await chat_history.append(user_id, {"role": "user", "content": message})
+            summary = await chat_history.summary(user_id)
+            schedule_compaction(user_id, len(user_messages))
+            if profile:
+                profile.add_stage("history", time.perf_counter() - started)
+                stage_started = time.perf_counter()
+            # Answers depend on the index and on the conversation before this question
+            try:
+                question_vector = await budget.within(query_embeddings.aembed_query(message), {"deadline": deadline})
+            except DeadlineExceeded:
+                question_vector = None
+            fingerprint = context_fingerprint(
+                index_generation, summary, [get_message_role_content(m) for m in user_messages[:-1]]
+            )
+            answer = None if question_vector is None else answer_cache.lookup(message, question_vector, fingerprint)
+            if profile:
+                profile.add_stage("answer_cache", time.perf_counter() - stage_started)
+        span.set_attributes({"chat.history_messages": len(user_messages), "answer_cache.hit": answer is not None})
+        if question_vector is None or answer is not None:
+            if question_vector is None:
+                DEADLINES_EXCEEDED.inc()
+                event, outcome = {"type": "final", "answer": TIMED_OUT_ANSWER, "timed_out": True}, "timed_out"
+            else:
+                event, outcome = {"type": "final", "answer": answer, "cached": True}, "cached"
+            CHAT_LATENCY.labels(outcome=outcome).observe(time.perf_counter() - started)
+            span.set_attribute("chat.outcome", outcome)
+            if profile:
+                event["profile"] = profile.to_dict()
+            yield event
+            return
+        graph_started = time.perf_counter()
+        async for event in stream_graph(user_messages, summary, deadline, trace.set_span_in_context(span), profile):
+            if event["type"] == "final":
+                if event["answer"]:
+                    answer_cache.store(message, question_vector, fingerprint, event["answer"])
+                    outcome = "answered"
+                elif event.get("timed_out"):
+                    event["answer"] = TIMED_OUT_ANSWER
+                    outcome = "timed_out"
+                else:
+                    event["answer"] = "No answer generated."
+                    outcome = "empty"
+                CHAT_LATENCY.labels(outcome=outcome).observe(time.perf_counter() - started)
+                span.set_attribute("chat.outcome", outcome)
+                if profile:
+                    profile.add_stage("graph", time.perf_counter() - graph_started)
+                    event["profile"] = profile.to_dict()
+            yield event
+    finally:
+        span.end()
+
+
+def sse_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
 
-# In-memory chat history per user
-chat_history = {}
 
 @app.post("/chat")
 async def chat(request: Request):
+    """Answer a message as JSON, or as a Server-Sent Events stream when the client accepts text/event-stream.
+
+    With an `X-Agent-Profile: 1` header the answer (or final event) also carries a timing breakdown.
+    """
     CHAT_REQUESTS.inc()
+    ensure_ready()
+    profile = RequestProfile() if profiling_requested(request.headers.get(PROFILE_HEADER)) else None
     data = await request.json()
     user_id = data.get("user_id", "anonymous")
     message = data["message"]
-    chat_history.setdefault(user_id, []).append({"role": "user", "content": message})
-    # Integrate workflow logic
-    user_messages = chat_history[user_id]
-    # Convert to LangChain messages format
-    lc_messages = convert_to_messages(user_messages)
-    # Run the workflow graph
+    if "text/event-stream" in request.headers.get("accept", ""):
+        async def events():
+            async for event in chat_turn(user_id, message, profile):
+                yield sse_event(event)
+            CHAT_RESPONSES.inc()
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
     answer = None
-    async for chunk in graph.astream({"messages": lc_messages}):
-        for node, update in chunk.items():
-            if update["messages"]:
-                last_msg = update["messages"][-1]
-                if isinstance(last_msg, dict):
-                    answer = last_msg.get("content", "")
-                else:
-                    answer = getattr(last_msg, "content", str(last_msg))
+    async for event in chat_turn(user_id, message, profile):
+        if event["type"] == "final":
+            answer = event["answer"]
     CHAT_RESPONSES.inc()
-    return JSONResponse({"answer": answer or "No answer generated."})
+    body = {"answer": answer or "No answer generated."}
+    if profile:
+        body["profile"] = profile.to_dict()
+    return JSONResponse(body)
 
 @app.websocket("/chat/ws")
 async def chat_ws(websocket: WebSocket):
+    """Each text message is a question; every event of the answer is sent back as a JSON frame.
+
+    Connecting with an `X-Agent-Profile: 1` header or `?profile=1` adds a timing breakdown to each final event.
+    """
     await websocket.accept()
+    if graph is None:
+        await websocket.close(code=1013, reason="Index is still loading")
+        return
     user_id = websocket.query_params.get("user_id", "anonymous")
-    chat_history.setdefault(user_id, [])
+    profiling = profiling_requested(
+        websocket.headers.get(PROFILE_HEADER) or websocket.query_params.get("profile")
+    )
     try:
         while True:
             data = await websocket.receive_text()
-            chat_history[user_id].append({"role": "user", "content": data})
-            # Integrate workflow logic
-            user_messages = chat_history[user_id]
-            lc_messages = convert_to_messages(user_messages)
-            answer = None
-            async for chunk in graph.astream({"messages": lc_messages}):
-                for node, update in chunk.items():
-                    if update["messages"]:
-                        answer = update["messages"][-1].content
-                        await websocket.send_text(answer)
+            async for event in chat_turn(user_id, data, RequestProfile() if profiling else None):
+                await websocket.send_json(event)
     except WebSocketDisconnect:
         pass
 
 @app.get("/health")
 async def health():
     HEALTH_CHECKS.inc()
+    if index_error is not None:
+        return JSONResponse({"status": "failed", "detail": index_error}, status_code=503)
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    READY_CHECKS.inc()
+    if index_error is not None:
+        return JSONResponse({"status": "failed", "detail": index_error}, status_code=503)
+    if graph is None:
+        return JSONResponse({"status": "loading"}, status_code=503)
+    return {"status": "ready"}
+
 @app.get("/metrics")
 async def metrics():
-    return StreamingResponse(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/reindex")
+async def reindex():
+    """Revalidate the sources in the background and rebuild the index if any changed."""
+    global reindex_task
+    if reindex_task and not reindex_task.done():
+        return JSONResponse({"status": "already running"}, status_code=202)
+    reindex_task = asyncio.create_task(load_index_in_background(refresh=True))
+    return JSONResponse({"status": "started"}, status_code=202)
+
+@app.get("/debug/workflow")
+async def debug_workflow(format: Literal["mermaid", "png"] = "mermaid"):
+    """Diagram of the workflow graph as Mermaid source, or as a PNG rendered from it."""
+    ensure_ready()
+    if format not in workflow_diagrams:
+        try:
+            workflow_diagrams[format] = await asyncio.to_thread(render_workflow, format)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Rendering the diagram failed, try format=mermaid: {e}")
+    if format == "png":
+        return Response(workflow_diagrams[format], media_type="image/png")
+    return Response(workflow_diagrams[format], media_type="text/plain")
 
 @app.get("/history/{user_id}")
 async def get_history(user_id: str):
-    return {"history": chat_history.get(user_id, [])}
+    return {
+        "summary": await chat_history.summary(user_id),
+        "history": [message_to_dict(m) for m in await chat_history.messages(user_id)],
+    }
+
+# Upper bound on the calls in one /mcp/batch request, and on how many of them run at once
+MCP_BATCH_MAX_CALLS = int(os.getenv("MCP_BATCH_MAX_CALLS", "50"))
+MCP_BATCH_CONCURRENCY = int(os.getenv("MCP_BATCH_CONCURRENCY", "8"))
+
+
+async def invoke_mcp_tool(tool_name, payload):
+    """Call an MCP tool, turning its failures into HTTPExceptions."""
+    try:
+        return await mcp_client.call_tool(tool_name, payload)
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))}
+        )
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"MCP tool {tool_name} returned {e.response.status_code}")
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=502, detail=f"MCP tool {tool_name} returned a body that is not JSON")
+    except (httpx.TransportError, asyncio.TimeoutError):
+        raise HTTPException(status_code=504, detail=f"MCP tool {tool_name} did not respond")
+
+
+# Registered before /mcp/{tool_name}, which would otherwise take "batch" as a tool name
+@app.post("/mcp/batch")
+async def call_mcp_tools(request: Request):
+    """Run {"calls": [{"tool": ..., "payload": {...}}, ...]} concurrently.
+
+    Results come back in call order, each as {"tool", "result"} or {"tool", "error": {"status", "detail"}},
+    so one failing call does not fail the batch.
+    """
+    data = await request.json()
+    calls = data.get("calls") if isinstance(data, dict) else None
+    if not isinstance(calls, list) or not all(isinstance(c, dict) and c.get("tool") for c in calls):
+        raise HTTPException(status_code=400, detail='Expected {"calls": [{"tool": ..., "payload": {...}}, ...]}')
+    if len(calls) > MCP_BATCH_MAX_CALLS:
+        raise HTTPException(status_code=400, detail=f"At most {MCP_BATCH_MAX_CALLS} calls per batch")
+    slots = asyncio.Semaphore(MCP_BATCH_CONCURRENCY)
+
+    async def run(call):
+        tool_name = call["tool"]
+        async with slots:
+            try:
+                return {"tool": tool_name, "result": await invoke_mcp_tool(tool_name, call.get("payload", {}))}
+            except HTTPException as e:
+                return {"tool": tool_name, "error": {"status": e.status_code, "detail": e.detail}}
+            except Exception as e:
+                return {"tool": tool_name, "error": {"status": 500, "detail": str(e)}}
+
+    return {"results": await asyncio.gather(*(run(call) for call in calls))}
+
 
 @app.post("/mcp/{tool_name}")
 async def call_mcp_tool(tool_name: str, request: Request):
     payload = await request.json()
-    mcp = MCPClient()
-    result = await mcp.call_tool(tool_name, payload)
-    return result
+    return await invoke_mcp_tool(tool_name, payload)
 
@@ -1,21 +1,207 @@
-import httpx
+import asyncio
+import json
 import os
+import random
 import time
 from typing import Any
+import httpx
+from opentelemetry import trace
+from prometheus_client import Counter, Gauge
+from ttl_cache import MISSING, TTLCache
+from tracing import tracer
+
+MCP_TIMEOUT = float(os.getenv("MCP_TIMEOUT", "10"))
+MCP_RETRIES = int(os.getenv("MCP_RETRIES", "3"))
+MCP_MAX_CONNECTIONS = int(os.getenv("MCP_MAX_CONNECTIONS", "20"))
+# Calls in flight at once; callers beyond this wait for a slot
+MCP_MAX_CONCURRENCY = int(os.getenv("MCP_MAX_CONCURRENCY", "20"))
+# Consecutive failures that open a tool's circuit, and how long it stays open
+MCP_BREAKER_FAILURES = int(os.getenv("MCP_BREAKER_FAILURES", "5"))
+MCP_BREAKER_COOLDOWN = float(os.getenv("MCP_BREAKER_COOLDOWN", "30"))
+# Tools whose results may be cached, as "name" or "name:ttl_seconds", comma separated
+MCP_CACHED_TOOLS = os.getenv("MCP_CACHED_TOOLS", "")
+MCP_CACHE_TTL = float(os.getenv("MCP_CACHE_TTL", "300"))
+MCP_CACHE_SIZE = int(os.getenv("MCP_CACHE_SIZE", "1024"))
+
+MCP_CALLS = Counter('mcp_tool_calls_total', 'MCP tool calls by tool and outcome', ['tool', 'outcome'])
+MCP_CACHE_LOOKUPS = Counter(
+    'mcp_cache_lookups_total', 'Cached MCP tool lookups by tool and result (hit, miss, coalesced)', ['tool', 'result']
+)
+MCP_CACHE_SIZE_GAUGE = Gauge('mcp_cache_entries', 'MCP tool results currently cached', ['tool'])
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, tool_name: str, retry_after: float):
+        super().__init__(f"Circuit for MCP tool {tool_name} is open")
+        self.tool_name = tool_name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stop calling a failing tool for `cooldown` seconds after `failures` consecutive failures.
+
+    Once the cooldown has passed a single trial call is let through (half-open);
+    its success closes the circuit again and its failure reopens it.
+    """
+
+    def __init__(self, failures: int = MCP_BREAKER_FAILURES, cooldown: float = MCP_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial_running or self.retry_after() > 0:
+            return False
+        self.trial_running = True
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            self.opened_at = time.monotonic()
+
+
+def parse_cached_tools(spec: str, default_ttl: float = MCP_CACHE_TTL) -> dict[str, float]:
+    """Parse "lookup:60,search" into {"lookup": 60.0, "search": default_ttl}."""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, ttl = item.partition(":")
+        ttls[name.strip()] = float(ttl) if ttl else default_ttl
+    return ttls
+
+
+def payload_key(payload) -> str:
+    """Canonical JSON, so payloads differing only in key order or whitespace share an entry."""
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transport errors, timeouts, 429 and 5xx are worth retrying; other 4xx are the caller's fault."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
 
 class MCPClient:
-    def __init__(self, base_url: str = None):
+    """MCP tool client sharing one keep-alive connection pool across all requests.
+
+    Create one per process and close it with `aclose()` on shutdown.
+
+    Results of the tools in `cached_tools` (name -> TTL seconds) are kept in a
+    per-tool LRU+TTL cache keyed by the canonical JSON payload; only pure lookups
+    belong there. Identical calls to such a tool that arrive while one is in
+    flight wait for its result instead of calling the server again.
+    """
+
+    def __init__(
+        self,
+        base_url: str = None,
+        max_connections: int = MCP_MAX_CONNECTIONS,
+        max_concurrency: int = MCP_MAX_CONCURRENCY,
+        cached_tools: dict[str, float] = None,
+        cache_size: int = MCP_CACHE_SIZE,
+    ):
         self.base_url = base_url or os.getenv("MCP_BASE_URL", "http://localhost:8001")
-        self.client = httpx.AsyncClient()
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = httpx.AsyncClient(limits=limits, timeout=MCP_TIMEOUT)
+        self.slots = asyncio.Semaphore(max_concurrency)
+        self.breakers: dict[str, CircuitBreaker] = {}
+        if cached_tools is None:
+            cached_tools = parse_cached_tools(MCP_CACHED_TOOLS)
+        self.caches = {name: TTLCache(cache_size, ttl) for name, ttl in cached_tools.items()}
+        self.in_flight: dict[tuple[str, str], asyncio.Task] = {}
 
-    async def call_tool(self, tool_name: str, payload: dict, retries: int = 3, timeout: int = 10) -> Any:
+    async def call_tool(
+        self, tool_name: str, payload: dict, retries: int = MCP_RETRIES, timeout: float = MCP_TIMEOUT
+    ) -> Any:
+        with tracer.start_as_current_span(f"mcp {tool_name}", attributes={"mcp.tool": tool_name}) as span:
+            cache = self.caches.get(tool_name)
+            if cache is None:
+                return await self._call_server(tool_name, payload, retries, timeout)
+            key = payload_key(payload)
+            # A tool may legitimately return JSON null, which is cached like any other result
+            result = cache.get(key, MISSING)
+            if result is not MISSING:
+                MCP_CACHE_LOOKUPS.labels(tool=tool_name, result="hit").inc()
+                span.set_attribute("cache.result", "hit")
+                return result
+            task = self.in_flight.get((tool_name, key))
+            if task is not None:
+                MCP_CACHE_LOOKUPS.labels(tool=tool_name, result="coalesced").inc()
+                span.set_attribute("cache.result", "coalesced")
+            else:
+                MCP_CACHE_LOOKUPS.labels(tool=tool_name, result="miss").inc()
+                span.set_attribute("cache.result", "miss")
+                task = asyncio.create_task(self._fill_cache(cache, tool_name, key, payload, retries, timeout))
+                self.in_flight[(tool_name, key)] = task
+                task.add_done_callback(lambda _: self.in_flight.pop((tool_name, key), None))
+            # Shielded so one caller giving up does not cancel the call for the others
+            return await asyncio.shield(task)
+
+    async def _fill_cache(self, cache: TTLCache, tool_name: str, key: str, payload: dict, retries: int, timeout: float):
+        result = await self._call_server(tool_name, payload, retries, timeout)
+        # Errors raise above and are never cached
+        cache.set(key, result)
+        MCP_CACHE_SIZE_GAUGE.labels(tool=tool_name).set(len(cache))
+        return result
+
+    async def _call_server(self, tool_name: str, payload: dict, retries: int, timeout: float) -> Any:
         url = f"{self.base_url}/tools/{tool_name}"
+        breaker = self.breakers.setdefault(tool_name, CircuitBreaker())
+        span = trace.get_current_span()
         for attempt in range(retries):
+            span.set_attribute("mcp.attempts", attempt + 1)
+            if not breaker.allow():
+                MCP_CALLS.labels(tool=tool_name, outcome="circuit_open").inc()
+                raise CircuitOpenError(tool_name, breaker.retry_after())
+            # An open circuit only lets the half-open trial through, so this attempt is it
+            trial = breaker.opened_at is not None
             try:
-                response = await self.client.post(url, json=payload, timeout=timeout)
+                async with self.slots:
+                    response = await asyncio.wait_for(self.client.post(url, json=payload), timeout)
                 response.raise_for_status()
-                return response.json()
+                # A 2xx with a body that is not JSON is the server's failure, not a result
+                result = response.json()
+            except asyncio.CancelledError:
+                if trial:
+                    # Let the next caller run the half-open trial instead; a cancelled
+                    # non-trial call must not free the slot of a trial still running
+                    breaker.trial_running = False
+                raise
             except Exception as e:
-                if attempt == retries - 1:
+                retryable = is_retryable(e)
+                if isinstance(e, httpx.HTTPStatusError) and not retryable:
+                    # The tool answered; the request was bad, not the server
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                if not retryable or attempt == retries - 1:
+                    MCP_CALLS.labels(tool=tool_name, outcome="error").inc()
                     raise
-                time.sleep(2 ** attempt)
+                # Exponential backoff with full jitter, so retries from many requests spread out
+                await asyncio.sleep(random.uniform(0, 2 ** attempt))
+                continue
+            breaker.record_success()
+            MCP_CALLS.labels(tool=tool_name, outcome="ok").inc()
+            return result
+
+    async def aclose(self):
+        for task in list(self.in_flight.values()):
+            task.cancel()
+        await self.client.aclose()
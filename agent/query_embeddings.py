@@ -0,0 +1,63 @@
+import re
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter, Gauge
+from ttl_cache import TTLCache
+from tracing import tracer
+
+QUERY_EMBEDDING_CACHE_HITS = Counter('query_embedding_cache_hits_total', 'Query embeddings served from cache')
+QUERY_EMBEDDING_CACHE_MISSES = Counter('query_embedding_cache_misses_total', 'Query embeddings requested from the model')
+QUERY_EMBEDDING_CACHE_SIZE = Gauge('query_embedding_cache_entries', 'Query embeddings currently cached')
+
+
+def normalize_query(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Embeddings wrapper that keeps recent query embeddings in a bounded LRU+TTL cache.
+
+    Keys are (model, normalized query text), so repeated questions skip the
+    embedding round trip. Document embeddings pass straight through.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, maxsize: int = 1024, ttl: float = 3600):
+        self.underlying = underlying
+        self.model = model
+        self.cache = TTLCache(maxsize, ttl)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.underlying.aembed_documents(texts)
+
+    def _lookup(self, text: str):
+        key = (self.model, normalize_query(text))
+        vector = self.cache.get(key)
+        if vector is not None:
+            QUERY_EMBEDDING_CACHE_HITS.inc()
+        else:
+            QUERY_EMBEDDING_CACHE_MISSES.inc()
+        return key, vector
+
+    def _store(self, key, vector):
+        self.cache.set(key, vector)
+        QUERY_EMBEDDING_CACHE_SIZE.set(len(self.cache))
+
+    def embed_query(self, text: str) -> list[float]:
+        with tracer.start_as_current_span("embed_query", attributes={"embedding.model": self.model}) as span:
+            key, vector = self._lookup(text)
+            span.set_attribute("cache.hit", vector is not None)
+            if vector is None:
+                vector = self.underlying.embed_query(text)
+                self._store(key, vector)
+            return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        with tracer.start_as_current_span("embed_query", attributes={"embedding.model": self.model}) as span:
+            key, vector = self._lookup(text)
+            span.set_attribute("cache.hit", vector is not None)
+            if vector is None:
+                vector = await self.underlying.aembed_query(text)
+                self._store(key, vector)
+            return vector
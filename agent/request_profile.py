@@ -0,0 +1,69 @@
+import time
+from llm_metrics import RunTimingHandler, token_usage
+
+# Request header that turns on the timing breakdown for one chat turn
+PROFILE_HEADER = "x-agent-profile"
+
+
+def profiling_requested(value: str | None) -> bool:
+    return (value or "").lower() in ("1", "true", "yes")
+
+
+class RequestProfile:
+    """Timing breakdown of one chat turn, returned to the caller who asked for it.
+
+    Only created when the profiling header is sent; without it nothing is recorded.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.nodes = []
+        self.llm_calls = []
+        self.retrievals = []
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_node(self, node: str, seconds: float):
+        self.nodes.append({"node": node, "seconds": round(seconds, 4)})
+
+    def to_dict(self):
+        graph_seconds = self.stages.get("graph", 0.0)
+        node_seconds = sum(n["seconds"] for n in self.nodes)
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            # Time the graph run spent outside of any node: scheduling and waiting for the event loop
+            "queued_seconds": round(max(0.0, graph_seconds - node_seconds), 4),
+            "nodes": self.nodes,
+            "llm_calls": self.llm_calls,
+            "retrievals": self.retrievals,
+            "tokens": {
+                "prompt": sum(c.get("prompt_tokens", 0) for c in self.llm_calls),
+                "completion": sum(c.get("completion_tokens", 0) for c in self.llm_calls),
+            },
+        }
+
+
+class ProfileCallbackHandler(RunTimingHandler):
+    """Record each LLM and retriever call of a graph run into a RequestProfile."""
+
+    def __init__(self, profile: RequestProfile):
+        super().__init__()
+        self.profile = profile
+
+    def llm_finished(self, node, model, seconds, response):
+        call = {"node": node, "model": model, "seconds": round(seconds, 4)}
+        usage = token_usage(response)
+        if usage is not None:
+            call["prompt_tokens"], call["completion_tokens"] = usage
+        self.profile.llm_calls.append(call)
+
+    def llm_failed(self, node, model, seconds, error):
+        self.profile.llm_calls.append(
+            {"node": node, "model": model, "seconds": round(seconds, 4), "error": type(error).__name__}
+        )
+
+    def retrieval_finished(self, node, seconds, documents):
+        self.profile.retrievals.append({"node": node, "seconds": round(seconds, 4), "documents": len(documents)})
@@ -0,0 +1,99 @@
+import asyncio
+import sqlite3
+from history import SqliteHistoryStore
+
+
+def test_concurrent_appends_see_each_message_once(tmp_path):
+    users, turns = 200, 20
+
+    async def run():
+        store = SqliteHistoryStore(str(tmp_path / "history.db"), max_messages=turns, flush_interval=0.05, batch_size=100)
+
+        async def converse(user):
+            for turn in range(turns):
+                history = await store.append(user, {"role": "user", "content": f"{user} {turn}"})
+                # Every earlier message and this one, in order, none missing or repeated
+                assert [m.content for m in history] == [f"{user} {t}" for t in range(turn + 1)]
+                await asyncio.sleep(0)
+
+        try:
+            async with asyncio.TaskGroup() as conversations:
+                for u in range(users):
+                    conversations.create_task(converse(f"user-{u}"))
+            await store.flush()
+            assert [m.content for m in await store.messages("user-7")] == [f"user-7 {t}" for t in range(turns)]
+        finally:
+            await store.close()
+
+    asyncio.run(run())
+
+
+def test_failed_flush_keeps_the_batch(tmp_path):
+    async def run():
+        store = SqliteHistoryStore(str(tmp_path / "history.db"), flush_interval=3600)
+        try:
+            await store.append("alice", {"role": "user", "content": "hello"})
+            store._conn.execute(
+                "CREATE TEMP TRIGGER fail BEFORE INSERT ON messages BEGIN SELECT RAISE(ABORT, 'disk full'); END"
+            )
+            try:
+                await store.flush()
+            except sqlite3.DatabaseError:
+                pass
+            assert [m.content for m in await store.messages("alice")] == ["hello"]
+            store._conn.execute("DROP TRIGGER fail")
+            await store.flush()
+            assert store._pending == []
+            assert [m.content for m in await store.messages("alice")] == ["hello"]
+        finally:
+            await store.close()
+
+    asyncio.run(run())
+
+
+def test_summary_outlives_compacting_every_message(tmp_path):
+    async def run():
+        store = SqliteHistoryStore(str(tmp_path / "history.db"), idle_ttl=3600, flush_interval=3600)
+        try:
+            await store.append("alice", {"role": "user", "content": "hello"})
+            [message] = await store.messages("alice")
+            await store.compact("alice", "SUMMARY", message.id)
+            assert await store.messages("alice") == []
+            await store.evict_idle()
+            assert await store.summary("alice") == "SUMMARY"
+
+            # Idle once the summary is older than the TTL too
+            store.idle_ttl = -1
+            await store.evict_idle()
+            assert await store.summary("alice") == ""
+        finally:
+            await store.close()
+
+    asyncio.run(run())
+
+
+def test_compact_removes_only_what_the_summary_covers(tmp_path):
+    async def run():
+        path = str(tmp_path / "history.db")
+        first = SqliteHistoryStore(path, flush_interval=3600)
+        second = SqliteHistoryStore(path, flush_interval=3600)
+        try:
+            await first.append("alice", {"role": "user", "content": "one"})
+            older = await first.append("alice", {"role": "user", "content": "two"})
+            await first.flush()
+            # Another replica appends while the summary is being written
+            await second.append("alice", {"role": "user", "content": "three"})
+            await second.flush()
+
+            await first.compact("alice", "one, two", older[-1].id)
+            assert [m.content for m in await second.messages("alice")] == ["three"]
+
+            # A replica summarizing the same messages finds them gone and changes nothing
+            await second.compact("alice", "stale", older[-1].id)
+            assert await second.summary("alice") == "one, two"
+            assert [m.content for m in await first.messages("alice")] == ["three"]
+        finally:
+            await first.close()
+            await second.close()
+
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import pytest
+from loader import fetch_sources
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class SourceHandler(BaseHTTPRequestHandler):
+    """Stand-in for the guideline sources: /slow/<seconds>, /cached (ETag and 304), /broken."""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path.startswith("/slow/"):
+            time.sleep(float(self.path.rsplit("/", 1)[1]))
+            self.reply(200, f"content of {self.path}")
+        elif self.path == "/cached":
+            if self.headers.get("If-None-Match") == ETAG:
+                self.reply(304, "")
+            else:
+                self.reply(200, "cached content", {"ETag": ETAG, "Last-Modified": LAST_MODIFIED})
+        else:
+            self.reply(500, "broken")
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            data = body.encode()
+            self.send_header("Content-Type", "text/markdown")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SourceHandler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_fetches_overlap(server):
+    _, base = server
+    urls = [f"{base}/slow/{delay}" for delay in (0.5, 0.4, 0.3, 0.5, 0.2)]
+    started = time.perf_counter()
+    sources = asyncio.run(fetch_sources(urls))
+    elapsed = time.perf_counter() - started
+    # About the slowest source, not the 1.9s sum of all of them
+    assert elapsed < 1.0
+    assert [source.content for source in sources] == [f"content of {url.removeprefix(base)}" for url in urls]
+    assert all(source.changed for source in sources)
+
+
+def test_not_modified_reuses_the_previous_copy(server):
+    httpd, base = server
+    url = f"{base}/cached"
+    [first] = asyncio.run(fetch_sources([url]))
+    assert (first.content, first.etag, first.last_modified, first.changed) == (
+        "cached content", ETAG, LAST_MODIFIED, True
+    )
+    # The previous copy is stored with different content to tell a reuse from a refetch
+    previous = {url: {**first.validators(), "content": "previous content"}}
+    [second] = asyncio.run(fetch_sources([url], previous))
+    _, headers = httpd.requests[-1]
+    assert headers["If-None-Match"] == ETAG
+    assert headers["If-Modified-Since"] == LAST_MODIFIED
+    assert (second.content, second.etag, second.changed) == ("previous content", ETAG, False)
+
+
+def test_failed_fetch_falls_back_to_the_previous_copy(server):
+    _, base = server
+    broken, hanging = f"{base}/broken", f"{base}/slow/2"
+    previous = {
+        broken: {"etag": None, "last_modified": None, "content": "old broken"},
+        hanging: {"etag": None, "last_modified": None, "content": "old hanging"},
+    }
+    sources = asyncio.run(fetch_sources([broken, hanging], previous, timeout=0.5))
+    assert [(source.content, source.changed) for source in sources] == [("old broken", False), ("old hanging", False)]
+
+    # Without a previous copy there is nothing to fall back to
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(fetch_sources([broken]))
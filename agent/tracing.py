@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from opentelemetry import trace
+from opentelemetry.trace import Status, StatusCode
+from llm_metrics import token_usage
+
+tracer = trace.get_tracer("guidelines-agent")
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Open an OpenTelemetry span for every workflow node, model, tool and retriever run.
+
+    Spans nest like the runs that produced them; runs without a span of their own
+    (LangGraph internals, runnable sequences) are skipped over. Top-level spans hang
+    under `context`, or under the current span when it is None.
+    """
+
+    # Only starts and ends spans, so it runs on the event loop instead of an executor
+    run_inline = True
+
+    def __init__(self, context=None):
+        self.context = context
+        self._spans = {}
+        # run_id -> parent_run_id, for every run seen, to find the nearest traced ancestor
+        self._parents = {}
+
+    def span(self, run_id):
+        """The span open for a run, or None."""
+        return self._spans.get(run_id)
+
+    def _parent_context(self, parent_run_id):
+        while parent_run_id is not None:
+            span = self._spans.get(parent_run_id)
+            if span is not None:
+                return trace.set_span_in_context(span)
+            parent_run_id = self._parents.get(parent_run_id)
+        return self.context
+
+    def _start(self, name, run_id, parent_run_id, attributes):
+        self._parents[run_id] = parent_run_id
+        self._spans[run_id] = tracer.start_span(
+            name, context=self._parent_context(parent_run_id), attributes=attributes
+        )
+
+    def _end(self, run_id, error=None, attributes=None):
+        self._parents.pop(run_id, None)
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        if attributes:
+            span.set_attributes(attributes)
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+        span.end()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._start(f"node {node}", run_id, parent_run_id, {
+                "langgraph.node": node,
+                "langgraph.step": metadata.get("langgraph_step", -1),
+            })
+        else:
+            self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name", "unknown")
+        self._start(f"llm {model}", run_id, parent_run_id, {
+            "gen_ai.request.model": model,
+            "langgraph.node": metadata.get("langgraph_node", "none"),
+        })
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self.on_chat_model_start(serialized, prompts, run_id=run_id, parent_run_id=parent_run_id, metadata=metadata)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = token_usage(response)
+        attributes = None
+        if usage is not None:
+            attributes = {"gen_ai.usage.input_tokens": usage[0], "gen_ai.usage.output_tokens": usage[1]}
+        self._end(run_id, attributes=attributes)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "tool")
+        self._start(f"tool {name}", run_id, parent_run_id, {"tool.name": name})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        self._start("retrieve", run_id, parent_run_id, {})
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, attributes={"retrieval.documents": len(documents)})
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+@contextmanager
+def run_span(run_manager):
+    """Make the span traced for a LangChain run current.
+
+    Spans that the run's own code starts, such as the query embedding of a
+    retriever run executed in a worker thread, then nest under the run instead
+    of whatever span was current when the thread or task was created.
+    """
+    span = None
+    for handler in run_manager.handlers if run_manager else []:
+        if isinstance(handler, TracingCallbackHandler):
+            span = handler.span(run_manager.run_id)
+            break
+    if span is None:
+        yield
+        return
+    with trace.use_span(span, end_on_exit=False):
+        yield
@@ -0,0 +1,191 @@
+import uuid
+from typing import Any, Callable, Iterable, Optional, Sequence
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+def normalize(vectors) -> np.ndarray:
+    """Return a contiguous float32 copy of `vectors` with unit-length rows."""
+    matrix = np.array(vectors, dtype=np.float32, ndmin=2, order="C")
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k highest scores along the last axis, best first."""
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), scores.shape[:-1] + (n,))
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(idx, order, axis=-1)
+
+
+class MatrixVectorStore(VectorStore):
+    """In-memory vector store backed by one contiguous, pre-normalized float32 matrix.
+
+    A query is a single matrix-vector product against all chunk embeddings followed
+    by an argpartition top-k, so search cost stays in NumPy instead of Python loops.
+    Scores are cosine similarities.
+
+    An optional approximate index (see ann_index.IVFIndex) narrows each query to a
+    candidate subset that is then scored exactly; without one, search is brute force.
+    """
+
+    def __init__(self, embedding: Embeddings, index=None):
+        self.embedding = embedding
+        self.index = index
+        self.documents: list[Document] = []
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self):
+        return len(self.documents)
+
+    @classmethod
+    def from_embeddings(
+        cls, documents: Sequence[Document], vectors, embedding: Embeddings, index=None
+    ) -> "MatrixVectorStore":
+        """Build a store from documents whose embeddings were already computed."""
+        store = cls(embedding, index)
+        store.add_embeddings(documents, vectors)
+        return store
+
+    def add_embeddings(self, documents: Sequence[Document], vectors) -> list[str]:
+        if len(documents) == 0:
+            return []
+        rows = normalize(vectors)
+        if rows.shape[0] != len(documents):
+            raise ValueError(f"Got {len(documents)} documents but {rows.shape[0]} embeddings")
+        start = len(self.documents)
+        ids = []
+        for doc in documents:
+            doc_id = doc.id or str(uuid.uuid4())
+            self.documents.append(Document(id=doc_id, page_content=doc.page_content, metadata=doc.metadata))
+            ids.append(doc_id)
+        self.matrix = rows if self.matrix.size == 0 else np.vstack([self.matrix, rows])
+        if self.index is not None:
+            if self.index.trained:
+                self.index.add(rows, start)
+            else:
+                self.index.build(self.matrix)
+        return ids
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        *,
+        ids: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        documents = [
+            Document(id=doc_id, page_content=text, metadata=metadata)
+            for doc_id, text, metadata in zip(ids, texts, metadatas)
+        ]
+        return self.add_embeddings(documents, self.embedding.embed_documents(texts))
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        **kwargs: Any,
+    ) -> "MatrixVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, **kwargs)
+        return store
+
+    def get_by_ids(self, ids: Sequence[str], /) -> list[Document]:
+        wanted = set(ids)
+        return [doc for doc in self.documents if doc.id in wanted]
+
+    def scores(self, query_vectors) -> np.ndarray:
+        """Cosine similarity of each query row against every stored chunk, shape (queries, chunks)."""
+        return normalize(query_vectors) @ self.matrix.T
+
+    def similarity(self, query_vector, positions) -> np.ndarray:
+        """Cosine similarity of one query against the chunks at the given positions."""
+        return self.matrix[np.asarray(positions, dtype=np.int64)] @ normalize(query_vector)[0]
+
+    def search_by_vectors(
+        self,
+        query_vectors,
+        k: int = 4,
+        filter: Optional[Callable[[Document], bool]] = None,
+        nprobe: Optional[int] = None,
+    ) -> list[list[tuple[Document, float]]]:
+        """Batched search: return the top-k (document, score) pairs for every query vector."""
+        if not self.documents:
+            return [[] for _ in range(len(query_vectors))]
+        if self.index is not None and self.index.trained:
+            return self._search_index(normalize(query_vectors), k, filter, nprobe)
+        scores = self.scores(query_vectors)
+        if filter is not None:
+            mask = np.array([not filter(doc) for doc in self.documents])
+            scores[:, mask] = -np.inf
+        results = []
+        for row, idx in zip(scores, top_k(scores, k)):
+            results.append([
+                (self.documents[i], float(row[i]))
+                for i in idx
+                if np.isfinite(row[i])
+            ])
+        return results
+
+    def _search_index(self, queries: np.ndarray, k: int, filter, nprobe) -> list[list[tuple[Document, float]]]:
+        results = []
+        for query, candidates in zip(queries, self.index.candidates(queries, nprobe)):
+            if filter is not None:
+                candidates = np.array([i for i in candidates if filter(self.documents[i])], dtype=np.int64)
+            scores = self.matrix[candidates] @ query
+            results.append([
+                (self.documents[candidates[i]], float(scores[i]))
+                for i in top_k(scores, k)
+            ])
+        return results
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        filter: Optional[Callable[[Document], bool]] = None,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        return self.search_by_vectors([embedding], k, filter)[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> list[tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def batch_similarity_search_with_score(
+        self, queries: Sequence[str], k: int = 4, **kwargs: Any
+    ) -> list[list[tuple[Document, float]]]:
+        """Embed all queries in one request and search them with one matrix product."""
+        if not queries:
+            return []
+        return self.search_by_vectors(self.embedding.embed_documents(list(queries)), k, **kwargs)
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Scores are already cosine similarities; clamp float error and negatives into [0, 1]
+        return lambda score: min(1.0, max(0.0, score))
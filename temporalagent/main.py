@@ -87,12 +87,24 @@ from langchain_openai import OpenAIEmbeddings
 #     model="text-embedding-3-small",
 # )
 
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-qwen3-embedding-0.6b",
-    base_url="http://watzmann:1234/v1",
-    api_key=None, # Placeholder API key
-    check_embedding_ctx_length=False
-)
+# MODEL_BACKEND=fake swaps the LM Studio models for the offline, deterministic ones in ../agent/fake_models.py
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "lmstudio")
+if MODEL_BACKEND == "fake":
+    import importlib.util
+    # Loaded from its path, so the agent's directory does not have to be put on sys.path
+    spec = importlib.util.spec_from_file_location(
+        "fake_models", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent", "fake_models.py")
+    )
+    fake_models = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fake_models)
+    embeddings = fake_models.FakeEmbeddings()
+else:
+    embeddings = OpenAIEmbeddings(
+        model="text-embedding-qwen3-embedding-0.6b",
+        base_url="http://watzmann:1234/v1",
+        api_key=None, # Placeholder API key
+        check_embedding_ctx_length=False
+    )
 
 # Disable LangSmith tracing to avoid unnecessary overhead during chunking
 os.environ["LANGSMITH_TRACING"] = "false"
@@ -277,11 +289,14 @@ from langchain_openai import ChatOpenAI
 # Replace with your LM Studio server address and port
 lm_studio_endpoint = "http://watzmann:1234/v1" 
 
-llm = ChatOpenAI(
-    model="qwen/qwen2.5-vl-7b",
-    base_url=lm_studio_endpoint,
-    api_key=None,  # LM Studio doesn't require an API key
-)
+if MODEL_BACKEND == "fake":
+    llm = fake_models.FakeChatModel()
+else:
+    llm = ChatOpenAI(
+        model="qwen/qwen2.5-vl-7b",
+        base_url=lm_studio_endpoint,
+        api_key=None,  # LM Studio doesn't require an API key
+    )
 
 # Create the chain: prompt -> LLM -> structured output parser
 statement_extraction_chain = prompt | llm.with_structured_output(RawStatementList)